@@ -0,0 +1,228 @@
+"""
+Benchmarks for the KuDoS CLI's data-handling paths.
+
+Generates reproducible synthetic getSVAssignments and upload-marked
+payloads (10, 1k and 100k entries by default), times the functions that
+process them, and compares the results with a saved JSON baseline.
+
+Usage:
+    python bench.py                  # run and compare with bench_baseline.json
+    python bench.py --save           # run and record a new baseline
+    python bench.py --sizes 10,1000  # only some payload sizes
+
+Exits non-zero if any benchmark is slower than the baseline by more than
+the regression threshold.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+from unittest import mock
+from datetime import datetime, timezone, timedelta
+
+import kudos
+
+SIZES = (10, 1_000, 100_000)
+DEFAULT_BASELINE = "bench_baseline.json"
+DEFAULT_THRESHOLD = 1.25
+TARGET_TRIPOS = "Computer Science Tripos"
+# kudos.py reads templates relative to the working directory; bench.py may be run from anywhere
+INFOFILE_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), kudos.INFOFILE_TEMPLATE)
+
+TRIPOSES = [TARGET_TRIPOS, "Natural Sciences Tripos", "Mathematical Tripos"]
+COURSES = [
+    ("Algorithms", "Computer Science"), ("Operating Systems", "Computer Science"),
+    ("Compiler Construction", "Computer Science"), ("Databases", "Computer Science"),
+    ("Physics A", "Physics"), ("Chemistry A", "Chemistry"), ("Analysis I", "Mathematics"),
+]
+SURNAMES = ["Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Johnson", "Davies"]
+
+def _crsid(rng):
+    return "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 3))) + str(rng.randint(1, 999))
+
+def _user(rng):
+    return {
+        "CRSID": _crsid(rng),
+        "title": rng.choice(["Mr", "Ms", "Dr"]),
+        "firstName": rng.choice(["Alex", "Sam", "Jo", "Chris", "Robin"]),
+        "lastName": rng.choice(SURNAMES),
+    }
+
+def make_assignments(n, seed=0, now=None):
+    """
+    Build a synthetic getSVAssignments payload with n supervisions.
+
+    Bookings are spread either side of `now`, and allocations are under,
+    exactly or over booked, so every branch of the filters gets exercised.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    supervisions = []
+    for group_number in range(n):
+        course, subject = rng.choice(COURSES)
+        tripos = rng.choice(TRIPOSES)
+        bookings = [
+            {
+                "duration": 60,
+                "startTime": (now + timedelta(days=rng.randint(-60, 60), hours=rng.randint(9, 18))).isoformat(),
+                "venue": f"Room {rng.randint(1, 40)}",
+            }
+            for _ in range(rng.randint(0, 4))
+        ]
+        supervisor = _user(rng)
+        supervisor["name"] = f"{supervisor['firstName']} {supervisor['lastName']}"
+        supervisions.append({
+            "group": [
+                {"course": course, "subject": subject, "tripos": tripos}
+                for _ in range(rng.randint(1, 3))
+            ],
+            "groupNumber": group_number,
+            "minutesAllocated": rng.choice([120, 180, 240]),
+            "supervisor": supervisor,
+            "supervisees": [{"user": _user(rng)} for _ in range(rng.randint(1, 3))],
+            "bookings": bookings,
+        })
+    return supervisions
+
+def make_marked(n, seed=0, now=None):
+    """Build a synthetic upload-marked payload with n entries over the last 16 weeks"""
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    return [
+        {
+            "uuid": "%032x" % rng.getrandbits(128),
+            "start": (now - timedelta(minutes=rng.randint(0, 16 * 7 * 24 * 60))).isoformat(),
+            "CRSID": _crsid(rng),
+            "supervisorCRSID": _crsid(rng),
+            "groupNumber": rng.randint(1, 500),
+            "svNumber": rng.randint(1, 4),
+            "failed": rng.random() < 0.05,
+        }
+        for _ in range(n)
+    ]
+
+def time_call(fn, repeat=3):
+    """Best time per call in seconds, timeit-style"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def benchmarks(size, work_dir):
+    """
+    The benchmarks for one payload size.
+
+    Returns:
+        list: (name, zero-argument callable) pairs
+    """
+    supervisions = make_assignments(size, seed=size)
+    marked = make_marked(size, seed=size)
+    filtered = kudos.filter_supervisions(supervisions, TARGET_TRIPOS)
+    index = kudos.SupervisionIndex.from_payload(supervisions)
+    marked_index = kudos.MarkedIndex(marked)
+    store = kudos.open_store(":memory:")
+    kudos.store_marked(store, marked)
+    since = datetime.now(timezone.utc) - timedelta(weeks=kudos.DEFAULT_MARKED_WINDOW_WEEKS)
+    dir_name = os.path.join(work_dir, "Course_1")
+    os.makedirs(dir_name, exist_ok=True)
+
+    def browse_first_page():
+        with mock.patch("builtins.input", return_value="q"):
+            kudos.browse_marked(marked, page_size=40)
+
+    def synthetic_infofiles():
+        for supervision in filtered:
+            student = supervision["supervisees"][0]["user"]
+            kudos.create_synthetic_info(supervision, 1, dir_name, student)
+
+    return [
+        ("filter_supervisions", lambda: kudos.filter_supervisions(supervisions, TARGET_TRIPOS)),
+        ("get_unique_courses", lambda: kudos.get_unique_courses(filtered)),
+        ("calculate_available_slots", lambda: [kudos.calculate_available_slots(s) for s in filtered]),
+        ("SupervisionIndex.from_payload", lambda: kudos.SupervisionIndex.from_payload(supervisions)),
+        ("SupervisionIndex.filter", lambda: index.filter(TARGET_TRIPOS)),
+        ("filter_recent_supervisions", lambda: kudos.filter_recent_supervisions(marked)),
+        ("query_marked", lambda: kudos.query_marked(store, since=since)),
+        ("browse_marked", browse_first_page),
+        ("MarkedIndex", lambda: kudos.MarkedIndex(marked)),
+        ("MarkedIndex.search", lambda: marked_index.search("fail sv2")),
+        ("create_synthetic_info", synthetic_infofiles),
+    ]
+
+def run(sizes):
+    """
+    Run every benchmark at every size.
+
+    Returns:
+        dict: Seconds per call, keyed by "name[size]"
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir, \
+         mock.patch.object(kudos, "INFOFILE_TEMPLATE", INFOFILE_TEMPLATE):
+        for size in sizes:
+            for name, fn in benchmarks(size, work_dir):
+                # browse_marked and create_synthetic_info print as they go
+                with contextlib.redirect_stdout(io.StringIO()):
+                    seconds = time_call(fn)
+                key = f"{name}[{size}]"
+                results[key] = seconds
+                print(f"{key:<45} {seconds * 1000:>12.3f} ms", flush=True)
+    return results
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare results with a baseline.
+
+    Returns:
+        list: (key, baseline seconds, current seconds) for each regression
+    """
+    return [
+        (key, baseline[key], seconds)
+        for key, seconds in results.items()
+        if key in baseline and seconds > baseline[key] * threshold
+    ]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="KuDoS CLI benchmarks")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES),
+                        help="comma-separated payload sizes (default: %(default)s)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="baseline JSON file (default: %(default)s)")
+    parser.add_argument("--save", action="store_true",
+                        help="record these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="slowdown ratio counted as a regression (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(f"{'Benchmark':<45} {'Time/call':>15}")
+    print("-" * 61)
+    results = run(sizes)
+    print("-" * 61)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=1, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}; run with --save to record one.")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for key, before, after in regressions:
+        print(f"REGRESSION {key}: {before * 1000:.3f} ms -> {after * 1000:.3f} ms ({after / before:.2f}x)")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (threshold {args.threshold:g}x).")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,26 @@
+import argparse
+import bisect
+import codecs
+import functools
+import hashlib
 import json
 from datetime import datetime, timezone, timedelta
 import os, sys
 import shutil
-import requests
-import shutil
 from pathlib import Path
-import os
+import pickle
 import re
-import requests
+import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin, urlparse
 
-
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+# requests and selenium are comparatively slow to import, and selenium is
+# only needed for the first login, so both are imported where they are
+# used.  startup_check.py guards against them creeping back in here.
 
 # Configuration
 AUTH_URL = (
@@ -25,13 +29,160 @@ AUTH_URL = (
     "&desc=The%20KuDoS%20Project&msg=you%20requested%20an%20interactive%20login"
 )
 TARGET_DOMAIN = "kudos.chu.cam.ac.uk"
+RAVEN_HOST = "raven.cam.ac.uk"
+DEFAULT_KUDOS_URL = "https://kudos.chu.cam.ac.uk/kudos/rest/"
+
+def normalise_base_url(url):
+    """An API root with its trailing "/", so urljoin keeps its last segment (rest/)"""
+    return url if url.endswith("/") else url + "/"
+
+# API root, overridden by --base-url or the KUDOS_BASE_URL environment
+# variable (e.g. to run against kudos_sim.py)
+KUDOS_URL = normalise_base_url(os.environ.get("KUDOS_BASE_URL") or DEFAULT_KUDOS_URL)
+
+# Cheap endpoint used to check whether the KuDoSAuth cookie is still valid
+AUTH_CHECK_PATH = "users/defaults"
+AUTH_FAILURE_STATUSES = {401, 403}
+
+# (connect, read) timeouts in seconds, and keep-alive connections per host
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_POOL_SIZE = 10
+UPLOAD_WORKERS = 4
+DEFAULT_PREFETCH_CONCURRENCY = 8
+
+# Uploads are retried on these statuses (and on connection errors/timeouts),
+# waiting UPLOAD_BACKOFF, 2 * UPLOAD_BACKOFF, 4 * UPLOAD_BACKOFF, ... seconds
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+UPLOAD_BACKOFF = 2
+
+# watch mode: seconds between stat polls, and seconds of quiet before rebuilding
+WATCH_INTERVAL = 0.25
+DEFAULT_DEBOUNCE = 1.0
+
+# How far back marked work is shown by default ("marked_window_weeks" config key)
+DEFAULT_MARKED_WINDOW_WEEKS = 4
+
+class Span:
+    """A timed region of a trace; extra details can be attached with span[key] = value"""
+
+    __slots__ = ("tracer", "name", "args", "begin")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __setitem__(self, key, value):
+        self.args[key] = value
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.begin, end, self.args)
+        return False
+
+class NullSpan:
+    """Stand-in used when tracing is off: entering, exiting and tagging do nothing"""
+
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Tracer:
+    """
+    Collects timed spans and exports them in Chrome trace format.
+
+    The output loads in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.events = []
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def span(self, name, **args):
+        return Span(self, name, args)
+
+    def record(self, name, begin, end, args):
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (begin - self.origin) * 1e6,
+            "dur": (end - begin) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self):
+        """Print count, total, mean and max time per span name"""
+        totals = {}
+        for event in self.events:
+            count, total, longest = totals.get(event["name"], (0, 0.0, 0.0))
+            totals[event["name"]] = (count + 1, total + event["dur"], max(longest, event["dur"]))
+
+        print("\nTrace summary:")
+        print("-" * 80)
+        print(f"{'Span':<44} {'Count':>6} {'Total ms':>10} {'Mean ms':>9} {'Max ms':>9}")
+        print("-" * 80)
+        for name, (count, total, longest) in sorted(totals.items(), key=lambda t: t[1][1], reverse=True):
+            print(f"{name:<44} {count:>6} {total / 1000:>10.1f} {total / count / 1000:>9.1f} {longest / 1000:>9.1f}")
+        print("-" * 80)
+
+class NullTracer:
+    """Tracer used when --trace is not given"""
+
+    enabled = False
+
+    def span(self, name, **args):
+        return NULL_SPAN
+
+tracer = NullTracer()
+
+def span(name, **args):
+    """Time a region of the run when tracing is enabled: `with span("name") as s: ...`"""
+    return tracer.span(name, **args)
+
+def endpoint_name(url):
+    """Group API URLs for tracing, e.g. supervisions/infofile/*/*/*"""
+    path = urlparse(url).path
+    if "/rest/" in path:
+        path = path.split("/rest/", 1)[1]
+    return "/".join("*" if any(c.isdigit() for c in part) else part for part in path.split("/"))
 
 def login():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
     # Set up Selenium WebDriver
     options = Options()
 
     print("Starting browser automation...")
-    with webdriver.Chrome(options=options) as driver:
+    with span("login"), webdriver.Chrome(options=options) as driver:
         # Open the authentication URL
         driver.get(AUTH_URL)
         print("Waiting for user to log in...")
@@ -63,7 +214,9 @@ def login():
             print(f"Cookie: {kudos_auth_cookie}")
         else:
             print("KuDoSAuth cookie not found. Ensure login was successful.")
-        return {"crsid": username, "auth": kudos_auth_cookie['value'] }
+        # Session cookies have no expiry; they are only checked against the server
+        return {"crsid": username, "auth": kudos_auth_cookie['value'],
+                "auth_expiry": kudos_auth_cookie.get('expiry')}
 
 
 
@@ -153,11 +306,128 @@ def filter_supervisions(supervisions, target_tripos):
     
     return filtered_supervisions
 
+class Supervision:
+    """
+    Compact record for one getSVAssignments entry.
+
+    Everything the menus need (courses, triposes, booked and remaining
+    minutes, slot counts, supervisees by CRSID) is worked out once when
+    the payload is parsed.  The original entry is kept as `raw`.
+    """
+
+    __slots__ = (
+        "raw", "group_number", "supervisor_name", "courses", "triposes",
+        "bookings", "minutes_allocated", "booked_minutes", "remaining_minutes",
+        "booked_slots", "additional_slots", "last_start", "students",
+    )
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.group_number = raw['groupNumber']
+        self.supervisor_name = raw['supervisor'].get('name')
+        self.courses = tuple(dict.fromkeys(
+            (group['course'], group['subject'], group['tripos']) for group in raw['group']
+        ))
+        self.triposes = frozenset(group['tripos'] for group in raw['group'])
+        self.bookings = raw['bookings']
+        self.minutes_allocated = raw['minutesAllocated']
+        self.booked_minutes = sum(booking['duration'] for booking in self.bookings)
+        self.remaining_minutes = self.minutes_allocated - self.booked_minutes
+        self.booked_slots = len(self.bookings)
+        # Potential 60-minute slots not booked yet
+        self.additional_slots = max(self.remaining_minutes // 60, 0)
+        # Only fully booked supervisions need booking times to decide if they are still open
+        self.last_start = None
+        if self.remaining_minutes == 0 and self.bookings:
+            self.last_start = max(parse_datetime(booking['startTime']) for booking in self.bookings)
+        self.students = {
+            supervisee['user']['CRSID']: supervisee['user']
+            for supervisee in raw.get('supervisees', ())
+        }
+
+    @property
+    def total_slots(self):
+        return self.booked_slots + self.additional_slots
+
+    def is_open(self, now):
+        """Same booking criteria as filter_supervisions"""
+        if self.remaining_minutes > 0:
+            return True
+        return self.last_start is not None and self.last_start > now
+
+class SupervisionIndex:
+    """
+    Supervisions indexed by tripos and course, so each menu step is a lookup.
+    """
+
+    __slots__ = ("supervisions", "by_tripos", "by_course", "courses")
+
+    def __init__(self, supervisions):
+        self.supervisions = list(supervisions)
+        self.by_tripos = {}
+        self.by_course = {}
+        courses = set()
+        for supervision in self.supervisions:
+            for tripos in supervision.triposes:
+                self.by_tripos.setdefault(tripos, []).append(supervision)
+            for course in dict.fromkeys(course[0] for course in supervision.courses):
+                self.by_course.setdefault(course, []).append(supervision)
+            courses.update(supervision.courses)
+        self.courses = sorted(courses)
+
+    @classmethod
+    def from_payload(cls, payload):
+        """Build an index from the decoded getSVAssignments list"""
+        return cls(Supervision(raw) for raw in payload)
+
+    @classmethod
+    def filtered_from_payload(cls, payload, target_tripos, now=None):
+        """
+        Build an already filtered index from getSVAssignments entries.
+
+        `payload` can be a stream: entries are checked one at a time and
+        only the ones that pass are kept.
+        """
+        now = now or datetime.now(timezone.utc)
+        records = (
+            Supervision(raw) for raw in payload
+            if any(group['tripos'] == target_tripos for group in raw['group'])
+        )
+        return cls(record for record in records if record.is_open(now))
+
+    def __len__(self):
+        return len(self.supervisions)
+
+    def __iter__(self):
+        return iter(self.supervisions)
+
+    def filter(self, target_tripos, now=None):
+        """Indexed equivalent of filter_supervisions, returning a new index"""
+        now = now or datetime.now(timezone.utc)
+        return SupervisionIndex(
+            supervision for supervision in self.by_tripos.get(target_tripos, ())
+            if supervision.is_open(now)
+        )
+
+    def for_course(self, course):
+        return self.by_course.get(course, [])
+
+_config = None
+
 def load_config():
     """
     Load configuration from config.json file.
     Expected format: {"crsid": "abc123", "auth": "tok" }
+
+    Optional keys: "timeout" (seconds, or [connect, read]) and
+    "pool_size" (keep-alive connections kept open to KuDoS).
+    "auth_expiry" (Unix time) is recorded by login().
+    The file is only read once per run.
     """
+    global _config
+    if _config is not None:
+        return _config
+
     if not os.path.exists('config.json'):
         with open('config.json', 'w') as f:
             json.dump(login(), f)
@@ -167,16 +437,615 @@ def load_config():
             config = json.load(f)
             if 'crsid' not in config:
                 raise ValueError("Config file must contain 'crsid' field")
+            _config = config
             return config
     except FileNotFoundError:
         raise FileNotFoundError("Config file not found. Please create config.json with your CRSID")
     except json.JSONDecodeError:
         raise ValueError("Invalid JSON in config file")
 
+def save_config(config):
+    """Write config.json and make it the config for the rest of this run"""
+    global _config
+    with open('config.json', 'w') as f:
+        json.dump(config, f)
+    _config = config
+
+def renew_auth():
+    """
+    Log in again through the browser and store the new cookie in config.json.
+
+    Returns:
+        tuple: (auth cookie value, expiry as Unix time or None)
+    """
+    config = dict(load_config())
+    fresh = login()
+    if not fresh['crsid']:
+        # Keep the known CRSID if the login page could not be scraped
+        del fresh['crsid']
+    config.update(fresh)
+    save_config(config)
+    return config['auth'], config.get('auth_expiry')
+
+class KuDoSClient:
+    """
+    Pooled HTTP client for the KuDoS REST API.
+
+    Wraps a single keep-alive session with the KuDoSAuth cookie attached,
+    so repeated calls reuse open connections instead of paying a fresh
+    TCP+TLS handshake each time.
+
+    If a `reauthenticate` callable is given, the client also manages the
+    cookie's lifetime.  A cookie past its expiry is renewed before use.
+    When a request is rejected, the cookie is checked with one cheap
+    request (cached for the session), and renewed only if that check
+    fails too.  Launching a browser is far slower than anything else the
+    tool does, so it is never done on suspicion alone.
+    """
+
+    def __init__(self, auth, base_url=None, timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE,
+                 expires=None, reauthenticate=None):
+        import requests
+        import requests.adapters
+
+        self.base_url = base_url or KUDOS_URL
+        self.timeout = timeout
+        self.reauthenticate = reauthenticate
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._validated_auth = None
+        self.set_auth(auth, expires)
+
+    def set_auth(self, auth, expires=None):
+        self.auth = auth
+        self.expires = expires
+        self.session.cookies.set("KuDoSAuth", auth)
+
+    def url(self, path):
+        """Resolve a path relative to the API root; absolute URLs pass through."""
+        return urljoin(self.base_url, path)
+
+    def is_expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    @staticmethod
+    def is_auth_failure(response):
+        """Whether KuDoS rejected the cookie (or bounced us to Raven to log in)"""
+        if response.status_code in AUTH_FAILURE_STATUSES:
+            return True
+        location = response.headers.get('Location', '') if response.is_redirect else response.url
+        return RAVEN_HOST in location
+
+    def validate(self):
+        """
+        Check the current cookie with one cheap request.
+
+        A positive result is remembered for the rest of the session.
+        """
+        if self._validated_auth == self.auth:
+            return True
+        auth = self.auth
+        response = self._send("GET", self.url(AUTH_CHECK_PATH), timeout=self.timeout, allow_redirects=False)
+        valid = response.status_code == 200 and not self.is_auth_failure(response)
+        if valid:
+            self._validated_auth = auth
+        return valid
+
+    def renew(self, stale_auth):
+        """Re-authenticate, unless another thread already replaced stale_auth"""
+        with self._lock:
+            if self.auth != stale_auth:
+                return
+            print("KuDoS login has expired, logging in again...")
+            self.set_auth(*self.reauthenticate())
+            self._validated_auth = self.auth
+
+    def ensure_authenticated(self):
+        """Make sure the cookie is usable, re-authenticating only if it really is not"""
+        if self.reauthenticate is None:
+            return
+        stale_auth = self.auth
+        if self.is_expired() or not self.validate():
+            self.renew(stale_auth)
+
+    def _send(self, method, url, **kwargs):
+        if not tracer.enabled:
+            return self.session.request(method, url, **kwargs)
+        with span(f"{method} {endpoint_name(url)}", url=url) as s:
+            data = kwargs.get("data")
+            if data is not None:
+                s['bytes_sent'] = len(data)
+            response = self.session.request(method, url, **kwargs)
+            s['status'] = response.status_code
+            if not kwargs.get("stream"):
+                s['bytes_received'] = len(response.content)
+            return response
+
+    def request(self, method, path, renew=True, **kwargs):
+        """
+        Send a request, logging in again if the cookie has expired or is rejected.
+
+        With renew=False no login is ever started, and a rejected response is
+        returned as it is.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        renew = renew and self.reauthenticate is not None
+        if renew and self.is_expired():
+            self.renew(self.auth)
+
+        sent_auth = self.auth
+        response = self._send(method, url, **kwargs)
+        if not renew or not self.is_auth_failure(response):
+            return response
+        # A streamed body has already been consumed and cannot be replayed
+        if hasattr(kwargs.get("data"), "read"):
+            return response
+        # The request itself may be forbidden even though the cookie is fine
+        if sent_auth == self.auth and self.validate():
+            return response
+        self.renew(sent_auth)
+        return self._send(method, url, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+_client = None
+
+def set_base_url(url):
+    """
+    Point the CLI at another KuDoS API root for the rest of this run.
+
+    The URL is also exported as KUDOS_BASE_URL, so background processes
+    (the upload drainer) talk to the same server.
+    """
+    global KUDOS_URL
+    url = normalise_base_url(url)
+    KUDOS_URL = url
+    os.environ["KUDOS_BASE_URL"] = url
+    if _client is not None:
+        _client.base_url = url
+
+def get_client():
+    """Return the shared KuDoS client, creating it from config.json on first use."""
+    global _client
+    if _client is None:
+        config = load_config()
+        timeout = config.get('timeout', DEFAULT_TIMEOUT)
+        if isinstance(timeout, list):
+            timeout = tuple(timeout)
+        _client = KuDoSClient(
+            config['auth'],
+            base_url=KUDOS_URL,
+            timeout=timeout,
+            pool_size=config.get('pool_size', DEFAULT_POOL_SIZE),
+            expires=config.get('auth_expiry'),
+            reauthenticate=renew_auth,
+        )
+    return _client
+
+_prefetched = {}
+
+def prefetch(key, fn, *args, **kwargs):
+    """
+    Start fn(*args, **kwargs) on a background thread, for prefetched_or_call(key, ...) to pick up.
+
+    fn should only fetch and keep quiet: it runs while the user is at a
+    prompt.  The thread is a daemon, so a prefetch nobody waits for is
+    simply abandoned when the program exits.
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=f"prefetch-{key}", daemon=True).start()
+    _prefetched[key] = future
+
+def prefetched_or_call(key, fn, *args, **kwargs):
+    """
+    Result of the background call started under key, waiting for it if it
+    is still running, or of fn(*args, **kwargs) if nothing was prefetched or
+    it failed.
+    """
+    future = _prefetched.pop(key, None)
+    if future is not None:
+        try:
+            return future.result()
+        except Exception:
+            pass  # try again in the foreground, where errors are reported
+    return fn(*args, **kwargs)
+
+def prefetch_get(url):
+    """
+    GET url for prefetch(): never starts a login, and fails rather than
+    returning a rejected response, so the foreground call deals with both.
+    """
+    response = get_client().get(url, renew=False)
+    if KuDoSClient.is_auth_failure(response):
+        raise PermissionError(f"KuDoS rejected the cookie (HTTP {response.status_code})")
+    return response
+
+def infofile_url(course_entry, slot_num):
+    """URL of the infofile for a (1-indexed) slot of a supervision"""
+    supervisor_crsid = course_entry['supervisor']['CRSID']
+    group_id = course_entry['groupNumber']
+    return urljoin(KUDOS_URL, f"supervisions/infofile/{supervisor_crsid}/{group_id}/{slot_num}")
+
+CACHE_DIR = ".kudos_cache"
+DEFAULT_CACHE_TTL = 24 * 60 * 60  # users/defaults and assignments change about once a term
+DEFAULT_INFOFILE_TTL = 10 * 60  # venues and times can still move before a supervision
+STREAM_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = " \t\n\r"
+# Characters that can make up a JSON number, true, false or null
+JSON_SCALAR_CHARS = frozenset("0123456789+-.eEtruefalsn")
+
+def server_dir():
+    """
+    Directory under CACHE_DIR for everything tied to the KuDoS server in use.
+
+    Cached responses, the local store, the outbox and the archive are kept
+    per base URL, so runs against a simulator (see --base-url) never mix
+    with the real server's data.
+    """
+    key = hashlib.sha256(KUDOS_URL.encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"{urlparse(KUDOS_URL).hostname}-{key}")
+
+def _cache_file(path):
+    """On-disk location of the cached response for an API path"""
+    return Path(server_dir()) / (re.sub(r"[^A-Za-z0-9_.-]", "_", path) + ".pickle")
+
+def _read_cache(cache_file):
+    """
+    Read a cached response.
+
+    Returns:
+        tuple: (meta dict, decoded data), or (None, None) if there is no usable entry
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            return pickle.load(f), pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None, None
+
+def _write_cache(cache_file, meta, data):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    with open(tmp_file, "wb") as f:
+        pickle.dump(meta, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+def cached_get_json(path, ttl=None, offline=False):
+    """
+    GET a JSON endpoint through the on-disk response cache.
+
+    Entries younger than the TTL are served without touching the network.
+    Stale entries are revalidated with If-None-Match / If-Modified-Since,
+    so an unchanged payload costs a 304 rather than a full transfer.
+
+    Args:
+        path (str): API path relative to KUDOS_URL
+        ttl (int): Freshness window in seconds, defaults to the "cache_ttl" config key
+        offline (bool): Serve only from the cache, never touching the network
+
+    Returns:
+        The decoded JSON, or None if it could not be fetched
+    """
+    import requests
+
+    cache_file = _cache_file(path)
+    meta, data = _read_cache(cache_file)
+
+    if offline:
+        if meta is None:
+            print(f"Error: no cached copy of {path}, run once without --offline first")
+        return data
+
+    if ttl is None:
+        ttl = load_config().get('cache_ttl', DEFAULT_CACHE_TTL)
+    if meta is not None and time.time() - cache_file.stat().st_mtime < ttl:
+        return data
+
+    try:
+        response = get_client().get(path, headers=_validator_headers(meta))
+    except requests.exceptions.RequestException as e:
+        if meta is None:
+            print(f"Error fetching {path}: {e}")
+            return None
+        print(f"Warning: could not reach KuDoS ({e}), using cached {path}")
+        return data
+
+    if response.status_code == 304 and meta is not None:
+        # Unchanged on the server: just restart the TTL clock
+        os.utime(cache_file)
+        return data
+    if response.status_code != 200:
+        print(f"Error: failed to fetch {path} (HTTP {response.status_code})")
+        return None
+
+    data = response.json()
+    _write_cache(cache_file, _validators(response), data)
+    return data
+
+def iter_json_array(chunks):
+    """
+    Incrementally decode a JSON array, yielding each element as soon as it is complete.
+
+    Only the undecoded tail of the input is held in memory, so peak memory
+    stays around one element rather than the whole payload.
+
+    Args:
+        chunks: Iterable of bytes, e.g. response.iter_content()
+
+    Raises:
+        ValueError: If the input is not a well-formed JSON array (a
+        json.JSONDecodeError where the position is known)
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buf = buf[pos:] + text.decode(b"", final=True)
+        else:
+            buf = buf[pos:] + text.decode(chunk)
+        pos = 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def value():
+        """Decode the element at pos, reading more input until it is complete"""
+        nonlocal pos
+        if buf[pos] in '{["':
+            # Containers and strings are self-delimiting: a decode that succeeds is final
+            while True:
+                try:
+                    item, pos = decoder.raw_decode(buf, pos)
+                    return item
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    fill()
+        # A number or literal might continue in the next chunk ("2." + "5"), so
+        # read until something that can't be part of it follows
+        length = 0
+        while True:
+            while pos + length < len(buf) and buf[pos + length] in JSON_SCALAR_CHARS:
+                length += 1
+            if pos + length < len(buf) or eof:
+                break
+            fill()
+        item, end = decoder.raw_decode(buf, pos)
+        if end != pos + length:
+            raise json.JSONDecodeError("Invalid JSON value", buf, pos)
+        pos = end
+        return item
+
+    skip(JSON_WHITESPACE)
+    if pos >= len(buf) or buf[pos] != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    skip(JSON_WHITESPACE)
+    if pos < len(buf) and buf[pos] == "]":
+        return
+
+    while True:
+        skip(JSON_WHITESPACE)
+        if pos >= len(buf):
+            raise ValueError("Unterminated JSON array")
+        item = value()
+        # An element only counts once the separator after it has been seen
+        skip(JSON_WHITESPACE)
+        if pos >= len(buf):
+            raise ValueError("Unterminated JSON array")
+        separator = buf[pos]
+        if separator not in ",]":
+            raise json.JSONDecodeError("Expected ',' or ']'", buf, pos)
+        pos += 1
+        yield item
+        if separator == "]":
+            return
+
+def iter_body(response):
+    """
+    Stream a response body in STREAM_CHUNK_SIZE chunks.
+
+    The request's own span ends when the headers arrive, so the transfer is
+    traced separately as "<request> body", with the bytes received and the
+    time spent waiting on the network (the rest is the caller's own work).
+    """
+    received = 0
+    waiting = 0.0
+    with span(f"{response.request.method} {endpoint_name(response.url)} body") as s:
+        try:
+            chunks = response.iter_content(STREAM_CHUNK_SIZE)
+            while True:
+                begin = time.perf_counter()
+                chunk = next(chunks, None)
+                waiting += time.perf_counter() - begin
+                if chunk is None:
+                    return
+                received += len(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The caller stopped reading, e.g. once it saw the closing "]"
+            return
+        finally:
+            s['bytes_received'] = received
+            s['network_ms'] = round(waiting * 1000, 3)
+
+def _validators(response):
+    return {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+
+def _validator_headers(meta):
+    """Conditional request headers for a cached response"""
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+def _read_cache_meta(cache_file):
+    """Metadata of a cached record stream, or None if there is none"""
+    try:
+        with open(cache_file, "rb") as f:
+            meta = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    # Whole-response entries written by cached_get_json are not record streams
+    return meta if meta.get('records') else None
+
+def _iter_cached_records(cache_file):
+    with open(cache_file, "rb") as f:
+        pickle.load(f)
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+def _stream_to_cache(response, cache_file):
+    """Yield a streamed JSON array's elements while appending them to the cache"""
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp")
+    complete = False
+    try:
+        with open(tmp_file, "wb") as f:
+            pickle.dump(dict(_validators(response), records=True), f, pickle.HIGHEST_PROTOCOL)
+            for item in iter_json_array(iter_body(response)):
+                pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+                yield item
+        complete = True
+    finally:
+        response.close()
+        if complete:
+            os.replace(tmp_file, cache_file)
+        elif tmp_file.exists():
+            # Never keep a half-read payload
+            tmp_file.unlink()
+
+def cached_iter_json(path, ttl=None, offline=False):
+    """
+    Stream the elements of a JSON array endpoint through the on-disk cache.
+
+    Same caching rules as cached_get_json, but nothing holds the whole
+    payload: elements are decoded as the bytes arrive (or unpickled one at
+    a time from the cache) and handed straight to the caller.
+
+    Returns:
+        An iterator over the array's elements, or None if it could not be fetched
+    """
+    import requests
+
+    cache_file = _cache_file(path)
+    meta = _read_cache_meta(cache_file)
+
+    if offline:
+        if meta is None:
+            print(f"Error: no cached copy of {path}, run once without --offline first")
+            return None
+        return _iter_cached_records(cache_file)
+
+    if ttl is None:
+        ttl = load_config().get('cache_ttl', DEFAULT_CACHE_TTL)
+    if meta is not None and time.time() - cache_file.stat().st_mtime < ttl:
+        return _iter_cached_records(cache_file)
+
+    try:
+        response = get_client().get(path, headers=_validator_headers(meta), stream=True)
+    except requests.exceptions.RequestException as e:
+        if meta is None:
+            print(f"Error fetching {path}: {e}")
+            return None
+        print(f"Warning: could not reach KuDoS ({e}), using cached {path}")
+        return _iter_cached_records(cache_file)
+
+    if response.status_code == 304 and meta is not None:
+        response.close()
+        os.utime(cache_file)
+        return _iter_cached_records(cache_file)
+    if response.status_code != 200:
+        response.close()
+        print(f"Error: failed to fetch {path} (HTTP {response.status_code})")
+        return None
+    return _stream_to_cache(response, cache_file)
+
 INFOFILE_NAME = "infofile.tex"
 WORKFILE_NAME = "work.tex"
+MANIFEST_NAME = ".kudos_build.json"
+
+SVUPLOADKEY_RE = re.compile(r"\\newcommand{\\svuploadkey}{(https?://[^\s]+)}")
+# \input{...}, \include{...}, \includegraphics[...]{...}, \lstinputlisting[...]{...}
+# and \verbatiminput{...} references in LaTeX source
+LATEX_INPUT_RE = re.compile(
+    r"\\(input|include|includegraphics|lstinputlisting|verbatiminput)\*?\s*(?:\[[^\]]*\])?\s*{([^}]+)}")
+# \epsfig{file=fig,width=...} and its older spelling \psfig
+EPSFIG_RE = re.compile(r"\\(?:epsfig|psfig)\s*{[^}]*?\bfile\s*=\s*([^,}\s]+)")
+# Tried in turn for an \includegraphics without an extension, as pdflatex does
+GRAPHICS_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".eps")
+
+# Engines compile_latex can use.  The preamble engine runs pdflatex on top of
+# a format with the template's packages preloaded (see preamble_format).
+TECTONIC_ENGINE = "tectonic"
+PREAMBLE_ENGINE = "pdflatex-preamble"
+TEMPLATE_INCLUDES = "../template/includes.tex"
+PREAMBLE_DRIVER_NAME = ".kudos_preamble.tex"
+MAX_LATEX_RUNS = 3
+DOCUMENTCLASS_RE = re.compile(r"^[ \t]*\\documentclass\s*(?:\[[^\]\n]*\])?\s*{[^}\n]*}", re.M)
+USEPACKAGE_RE = re.compile(r"\\usepackage\s*(\[[^\]]*\])?\s*{[^}]*}")
+LATEX_RERUN_RE = re.compile(r"Rerun to get|Label\(s\) may have changed")
+_preamble_lock = threading.Lock()
+
+# Optional post-compile PDF optimisation with Ghostscript and qpdf.  Images
+# are never downsampled below the "optimize_min_dpi" config key; 1-bit
+# images (scanned handwriting) keep at least MONO_MIN_DPI so strokes stay crisp
+GHOSTSCRIPT_COMMANDS = ("gs", "gswin64c", "gswin32c")
+DEFAULT_OPTIMIZE_MIN_DPI = 150
+MONO_MIN_DPI = 300
 
 def process_infofile(directory):
+    """
+    Refresh a supervision directory's infofile.tex from its \\svuploadkey URL.
+
+    The last response's validators and content hash are kept in the
+    response cache, per slot.  Within the "infofile_ttl" freshness window
+    nothing is fetched; after it the request is conditional, and the file
+    is only rewritten when the downloaded content actually differs, so an
+    unchanged infofile never invalidates the build.
+
+    Returns:
+        bool: False if the slot could not be fetched (e.g. it isn't booked)
+    """
+    import requests
+
     # Construct the full path to the infofile
     infofile_path = os.path.join(directory, INFOFILE_NAME)
 
@@ -185,178 +1054,1159 @@ def process_infofile(directory):
         print(f"Error: {INFOFILE_NAME} not found in {directory}")
         return False
 
-    with open(infofile_path, "r") as f:
+    with open(infofile_path, "rb") as f:
         content = f.read()
 
     # Extract the svuploadkey value
-    match = re.search(r"\\newcommand{\\svuploadkey}{(https?://[^\s]+)}", content)
+    match = SVUPLOADKEY_RE.search(content.decode(errors="replace"))
     if not match:
         return True
 
     svuploadkey = match.group(1)
 
-    # Download the file from svuploadkey
-    config = load_config()
-    response = requests.get(svuploadkey,  cookies={"KuDoSAuth": config['auth']})
+    # The cached validators only describe this file if it still holds what was downloaded
+    cache_file = _cache_file(svuploadkey)
+    meta, _ = _read_cache(cache_file)
+    if meta is not None and meta.get('sha256') != hashlib.sha256(content).hexdigest():
+        meta = None
+    ttl = load_config().get('infofile_ttl', DEFAULT_INFOFILE_TTL)
+    if meta is not None and time.time() - cache_file.stat().st_mtime < ttl:
+        return True
+
+    # Download the file from svuploadkey, unless it hasn't changed
+    try:
+        # The menu may already have fetched it in the background (unconditionally,
+        # so the response is usable whatever state the cache is in)
+        response = prefetched_or_call(svuploadkey, get_client().get, svuploadkey,
+                                      headers=_validator_headers(meta))
+    except requests.exceptions.RequestException as e:
+        if meta is None:
+            print(f"Error: Failed to download from {svuploadkey} ({e})")
+            return False
+        print(f"Warning: could not reach KuDoS ({e}), keeping {INFOFILE_NAME} in {directory}")
+        return True
+
+    if response.status_code == 304 and meta is not None:
+        os.utime(cache_file)
+        return True
     if response.status_code != 200:
         print(f"Error: Failed to download from {svuploadkey}, supo is not booked (HTTP {response.status_code})")
         return False
 
-    # Replace the infofile.tex content with the downloaded content
-    with open(infofile_path, "wb") as f:
-        f.write(response.content)
-    print(f"Replaced {INFOFILE_NAME} with the downloaded content.")
+    # Replace the infofile.tex content with the downloaded content, if it differs
+    if response.content != content:
+        with open(infofile_path, "wb") as f:
+            f.write(response.content)
+        print(f"Replaced {INFOFILE_NAME} with the downloaded content.")
+    _write_cache(cache_file, dict(_validators(response), sha256=hashlib.sha256(response.content).hexdigest()), None)
 
     return True
 
-def compile_latex(directory):
-    # Run tectonic to compile work.tex
-    workfile_path = os.path.join(directory, WORKFILE_NAME)
-    if not os.path.isfile(workfile_path):
-        print(f"Error: {WORKFILE_NAME} not found in {directory}")
-        return False
+def latex_dependencies(directory):
+    """
+    Find every file the build of work.tex reads, following \\input chains.
+
+    Paths are relative to directory, which is also where tectonic resolves
+    them (so ../template/template.tex pulls in ../template/includes.tex).
+    Images, listings and verbatim files count too; an image named without
+    an extension matches whichever of GRAPHICS_EXTENSIONS exist.
+
+    Returns:
+        list: Sorted relative paths of existing input files, work.tex included
+    """
+    seen = set()
+    # (path, whether it is TeX source to scan for further inputs)
+    pending = [(WORKFILE_NAME, True)]
+    while pending:
+        name, scan = pending.pop()
+        if name in seen:
+            continue
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        seen.add(name)
+        if not scan:
+            continue
+        with open(path, "r", errors="replace") as f:
+            # Drop comments so commented-out \input lines don't count
+            source = re.sub(r"(?<!\\)%.*", "", f.read())
+        for command, target in LATEX_INPUT_RE.findall(source):
+            target = target.strip()
+            if command == "includegraphics":
+                pending += [(candidate, False) for candidate in _graphics_candidates(target)]
+            elif command in ("lstinputlisting", "verbatiminput"):
+                pending.append((target, False))
+            elif "." in os.path.basename(target):
+                pending.append((target, True))
+            else:
+                pending.append((target + ".tex", True))
+        for target in EPSFIG_RE.findall(source):
+            pending += [(candidate, False) for candidate in _graphics_candidates(target)]
+    return sorted(seen)
+
+def _graphics_candidates(target):
+    """Files an image reference could resolve to: itself, or each known extension added"""
+    if os.path.splitext(target)[1]:
+        return [target]
+    return [target + extension for extension in GRAPHICS_EXTENSIONS]
+
+def file_sha256(path):
+    """SHA-256 of a file, read a block at a time"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_inputs(directory):
+    """Content hashes of all inputs of a build, keyed by relative path"""
+    return {name: file_sha256(os.path.join(directory, name)) for name in latex_dependencies(directory)}
 
+def _read_manifest(directory):
     try:
-        subprocess.run(
-            ["tectonic", WORKFILE_NAME ],
-            cwd=directory,
-            check=True,
-        )
-        print("LaTeX compilation successful.")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"Error: LaTeX compilation failed. {e}")
-        return False
+        with open(os.path.join(directory, MANIFEST_NAME), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
-def upload_pdf(directory):
-    # Check if the PDF file exists
+def _write_manifest(directory, manifest):
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+def is_up_to_date(directory, inputs=None, engine=TECTONIC_ENGINE):
+    """
+    Check whether work.pdf was built by `engine` from exactly the current inputs.
+    """
     pdf_path = os.path.join(directory, WORKFILE_NAME.replace(".tex", ".pdf"))
     if not os.path.isfile(pdf_path):
-        print(f"Error: Compiled PDF not found: {pdf_path}")
         return False
+    if inputs is None:
+        inputs = hash_inputs(directory)
+    manifest = _read_manifest(directory)
+    return manifest.get('inputs') == inputs and manifest.get('engine', TECTONIC_ENGINE) == engine
 
-    # Post the PDF file to the DUMMY_URL
-    config = load_config()
-    with open(pdf_path, "rb") as f:
-        response = requests.post("https://kudos.chu.cam.ac.uk/kudos/rest/supervisions/upload", data=f.read(), cookies={"KuDoSAuth": config['auth']})
-
-    if response.status_code == 200:
-        print("PDF uploaded successfully.")
-        return True
-    else:
-        print(f"Error: Failed to upload PDF (HTTP {response.status_code})")
-        print(response.text)
-        return False
+@functools.lru_cache(maxsize=None)
+def _pdflatex_version():
+    result = subprocess.run(["pdflatex", "--version"], capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()[0]
 
-def find_student_by_crsid(course_entry, target_crsid):
+def select_engine(preamble_cache, directory=None):
     """
-    Find student details in the supervision entry matching the CRSID.
-    Returns None if not found.
+    Name of the engine compile_latex will use.
+
+    Given a directory, this is the engine it will actually use there, which
+    is tectonic if the document doesn't follow the template layout or its
+    preamble format is known not to build.
     """
-    for supervisee in course_entry['supervisees']:
-        if supervisee['user']['CRSID'] == target_crsid:
-            return supervisee['user']
-    return None
+    if not (preamble_cache and shutil.which("pdflatex")):
+        return TECTONIC_ENGINE
+    if directory is not None:
+        preamble = split_preamble(directory)
+        if preamble is None or _preamble_failed(preamble[1]):
+            return TECTONIC_ENGINE
+    return PREAMBLE_ENGINE
 
-def fetch_booking(course_entry, slot_idx, synthesise_slot):
+def split_preamble(directory):
     """
-    Set up supervision working directory and fetch or create info file.
-    
-    Args:
-        course_entry: The supervision entry containing all supervision details
-        slot_idx: The index of the slot (0-based)
-        synthesise_slot: Boolean indicating if this is a synthetic slot
+    Work out the part of a document's preamble that is the same for every build.
+
+    That is the \\documentclass line of work.tex (with \\jkfside and friends
+    expanded from infofile.tex) followed by the \\usepackage lines of
+    template/includes.tex, up to the first one whose options depend on
+    per-document macros (hyperref's PDF metadata).
+
+    Returns:
+        tuple: (documentclass line as written in work.tex, format source),
+        or None if the document doesn't follow the template layout
     """
-    # Load config and get CRSID
-    config = load_config()
+    try:
+        with open(os.path.join(directory, WORKFILE_NAME), "r") as f:
+            work = f.read()
+        with open(os.path.join(directory, INFOFILE_NAME), "r") as f:
+            macros = dict(re.findall(r"\\newcommand{\\(\w+)}{([^}\n]*)}", f.read()))
+        with open(os.path.join(directory, TEMPLATE_INCLUDES), "r") as f:
+            includes = re.sub(r"(?<!\\)%.*", "", f.read())
+    except FileNotFoundError:
+        return None
+
+    match = DOCUMENTCLASS_RE.search(work)
+    if not match:
+        return None
+    documentclass = re.sub(r"\\(\w+)", lambda m: macros.get(m.group(1), m.group(0)), match.group(0).strip())
+    if "\\" in documentclass[1:]:
+        return None
+
+    packages = []
+    for package in USEPACKAGE_RE.finditer(includes):
+        if "\\" in (package.group(1) or ""):
+            break
+        packages.append(package.group(0))
+    return match.group(0), "\n".join([documentclass] + packages + ["\\dump", ""])
+
+def _preamble_files(source):
+    """Locations of the format built from a preamble source and of its failure marker"""
+    key = hashlib.sha256((_pdflatex_version() + source).encode()).hexdigest()[:16]
+    fmt_file = Path(CACHE_DIR, "preamble").resolve() / f"kudos-preamble-{key}.fmt"
+    return fmt_file, fmt_file.with_suffix(".failed")
+
+def _preamble_failed(source):
+    """Whether building a format from this preamble source already failed"""
+    return _preamble_files(source)[1].exists()
+
+def preamble_format(source):
+    """
+    Return a pdflatex format with the given preamble preloaded, building it if needed.
+
+    Formats are cached under .kudos_cache/preamble, named by a hash of the
+    preamble source and the pdflatex version, so editing the template files
+    (or upgrading TeX) simply selects a new format.  A failed build leaves
+    a .failed marker (holding the log) under the same name, so it is not
+    retried for that source.
+
+    Returns:
+        Path: The .fmt file, or None if it could not be built
+    """
+    fmt_file, failed_file = _preamble_files(source)
+    fmt_dir, name = fmt_file.parent, fmt_file.stem
+    if fmt_file.exists():
+        return fmt_file
+    if failed_file.exists():
+        return None
+
+    with _preamble_lock:
+        if fmt_file.exists():
+            return fmt_file
+        if failed_file.exists():
+            return None
+        print("Building cached LaTeX preamble...")
+        fmt_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=fmt_dir) as tmp_dir:
+            with open(os.path.join(tmp_dir, f"{name}.tex"), "w") as f:
+                f.write(source)
+            result = subprocess.run(
+                ["pdflatex", "-ini", f"-jobname={name}", "-interaction=nonstopmode",
+                 "-halt-on-error", "&pdflatex", f"{name}.tex"],
+                cwd=tmp_dir,
+                capture_output=True,
+                text=True,
+            )
+            built = os.path.join(tmp_dir, f"{name}.fmt")
+            if result.returncode != 0 or not os.path.isfile(built):
+                print("Error: could not build the cached preamble, falling back to tectonic.")
+                print(result.stdout[-2000:])
+                failed_file.write_text(result.stdout)
+                return None
+            os.replace(built, fmt_file)
+    return fmt_file
+
+def _run_pdflatex_with_format(directory, documentclass, fmt_file, quiet):
+    """
+    Compile work.tex with pdflatex on top of a preloaded preamble format.
+
+    The format already contains the document class, so the driver is
+    work.tex with its \\documentclass line commented out.  The template's
+    \\usepackage lines for preloaded packages are then no-ops.  Like
+    tectonic, pdflatex is rerun until cross-references settle.
+    """
+    with open(os.path.join(directory, WORKFILE_NAME), "r") as f:
+        work = f.read()
+    with open(os.path.join(directory, PREAMBLE_DRIVER_NAME), "w") as f:
+        f.write(work.replace(documentclass, "% " + documentclass + "  (preloaded)", 1))
+
+    env = dict(os.environ, TEXFORMATS=f"{fmt_file.parent}{os.pathsep}")
+    command = ["pdflatex", f"-fmt={fmt_file.stem}", f"-jobname={Path(WORKFILE_NAME).stem}",
+               "-interaction=nonstopmode", "-halt-on-error", PREAMBLE_DRIVER_NAME]
+    for _ in range(MAX_LATEX_RUNS):
+        result = subprocess.run(command, cwd=directory, env=env, capture_output=True, text=True)
+        if not quiet:
+            print(result.stdout, end="")
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+        if not LATEX_RERUN_RE.search(result.stdout):
+            break
+
+def compile_latex(directory, quiet=False, force=False, preamble_cache=False):
+    # Run tectonic to compile work.tex
+    workfile_path = os.path.join(directory, WORKFILE_NAME)
+    if not os.path.isfile(workfile_path):
+        print(f"Error: {WORKFILE_NAME} not found in {directory}")
+        return False
+
+    # Skip tectonic entirely when no input changed since the last build
+    inputs = hash_inputs(directory)
+    engine = select_engine(preamble_cache, directory)
+    if not force and is_up_to_date(directory, inputs, engine):
+        if not quiet:
+            print("Nothing changed since the last build, skipping LaTeX compilation.")
+        return True
+
+    # Optionally reuse a precompiled template preamble instead of tectonic
+    preamble = split_preamble(directory) if engine == PREAMBLE_ENGINE else None
+    fmt_file = preamble_format(preamble[1]) if preamble else None
+    if fmt_file is None:
+        engine = TECTONIC_ENGINE
+
+    try:
+        with span("compile_latex", directory=directory, engine=engine):
+            if fmt_file is not None:
+                _run_pdflatex_with_format(directory, preamble[0], fmt_file, quiet)
+            else:
+                # Concurrent builds would interleave tectonic's output, so batch
+                # runs capture it and only show it when the build fails
+                subprocess.run(
+                    ["tectonic", WORKFILE_NAME ],
+                    cwd=directory,
+                    check=True,
+                    capture_output=quiet,
+                    text=True,
+                )
+        _write_manifest(directory, {'inputs': inputs, 'engine': engine})
+        if not quiet:
+            print("LaTeX compilation successful.")
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"Error: LaTeX compilation failed in {directory}. {e}")
+        if quiet:
+            print(e.stdout + e.stderr)
+        return False
+
+def optimize_pdf(directory, min_dpi=None, quiet=False):
+    """
+    Shrink a supervision directory's work.pdf before it is uploaded.
+
+    Ghostscript downsamples and recompresses images to `min_dpi` (the
+    "optimize_min_dpi" config key by default), drops duplicate images and
+    subsets fonts; qpdf then linearizes the result.  Either tool is skipped
+    if it isn't installed.  The original is kept if the result isn't smaller,
+    and the outcome is recorded in the build manifest so an unchanged build
+    isn't optimised twice.
+
+    Returns:
+        bool: False if a tool failed, True otherwise (including when skipped)
+    """
+    pdf_path = os.path.join(directory, WORKFILE_NAME.replace(".tex", ".pdf"))
+    if not os.path.isfile(pdf_path):
+        print(f"Error: Compiled PDF not found: {pdf_path}")
+        return False
+    if min_dpi is None:
+        min_dpi = load_config().get('optimize_min_dpi', DEFAULT_OPTIMIZE_MIN_DPI)
+
+    manifest = _read_manifest(directory)
+    if manifest.get('optimized', {}).get('min_dpi') == min_dpi:
+        return True
+
+    gs = next(filter(None, map(shutil.which, GHOSTSCRIPT_COMMANDS)), None)
+    qpdf = shutil.which("qpdf")
+    if gs is None and qpdf is None:
+        if not quiet:
+            print("Neither Ghostscript nor qpdf is installed, not optimising the PDF.")
+        return True
+
+    original = os.path.getsize(pdf_path)
+    steps = []
+    if gs is not None:
+        steps.append(lambda src, dst: [
+            gs, "-sDEVICE=pdfwrite", "-dNOPAUSE", "-dBATCH", "-dQUIET", "-dSAFER",
+            "-dCompatibilityLevel=1.5", "-dDetectDuplicateImages=true",
+            "-dSubsetFonts=true", "-dCompressFonts=true",
+            "-dDownsampleColorImages=true", f"-dColorImageResolution={min_dpi}",
+            "-dColorImageDownsampleType=/Bicubic",
+            "-dDownsampleGrayImages=true", f"-dGrayImageResolution={min_dpi}",
+            "-dGrayImageDownsampleType=/Bicubic",
+            "-dDownsampleMonoImages=true", f"-dMonoImageResolution={max(min_dpi, MONO_MIN_DPI)}",
+            f"-sOutputFile={dst}", src,
+        ])
+    if qpdf is not None:
+        steps.append(lambda src, dst: [
+            qpdf, "--linearize", "--object-streams=generate", "--compress-streams=y",
+            "--recompress-flate", src, dst,
+        ])
+
+    with span("optimize_pdf", directory=directory, bytes=original) as s, \
+         tempfile.TemporaryDirectory(dir=directory) as tmp_dir:
+        src = pdf_path
+        for i, step in enumerate(steps):
+            dst = os.path.join(tmp_dir, f"step{i}.pdf")
+            command = step(src, dst)
+            result = subprocess.run(command, capture_output=True, text=True)
+            # qpdf exits with 3 for warnings, and still writes the file
+            if result.returncode not in (0, 3) or not os.path.isfile(dst):
+                print(f"Error: {os.path.basename(command[0])} failed on {pdf_path}")
+                print(result.stdout[-2000:] + result.stderr[-2000:])
+                return False
+            src = dst
+
+        optimized = os.path.getsize(src)
+        s['optimized_bytes'] = optimized
+        if optimized < original:
+            os.replace(src, pdf_path)
+        else:
+            optimized = original
+
+    manifest['optimized'] = {'min_dpi': min_dpi, 'original_bytes': original, 'bytes': optimized}
+    _write_manifest(directory, manifest)
+    if not quiet:
+        if optimized < original:
+            print(f"Optimised PDF: {original / 1e3:.0f} kB -> {optimized / 1e3:.0f} kB "
+                  f"({original - optimized:,} bytes saved, {100 * (original - optimized) / original:.0f}%).")
+        else:
+            print("PDF is already as small as optimisation gets it, keeping the original.")
+    return True
+
+class UploadReader:
+    """
+    File wrapper that streams an upload body from disk.
+
+    requests sizes the body through __len__ (so it still sends a plain
+    Content-Length rather than chunked encoding) and then pulls it through
+    read() a block at a time, which lets us report progress as it goes.
+    """
+
+    def __init__(self, f, total, progress=False):
+        self.f = f
+        self.total = total
+        self.progress = progress
+        self.sent = 0
+        self.started = time.monotonic()
+        self.last_report = 0.0
+
+    def __len__(self):
+        return self.total - self.sent
+
+    def read(self, size=-1):
+        chunk = self.f.read(size)
+        self.sent += len(chunk)
+        if self.progress and chunk:
+            now = time.monotonic()
+            if now - self.last_report >= 0.1 or self.sent == self.total:
+                self.last_report = now
+                rate = self.sent / max(now - self.started, 1e-6)
+                percent = 100 * self.sent // max(self.total, 1)
+                print(f"\r  Uploading: {percent:3d}% ({self.sent / 1e6:.1f}/{self.total / 1e6:.1f} MB, "
+                      f"{rate / 1e6:.1f} MB/s)", end="", flush=True)
+                if self.sent == self.total:
+                    print()
+        return chunk
+
+def post_pdf(pdf_path, progress=False):
+    """
+    Make one attempt at uploading a PDF to KuDoS, streaming it from disk.
+
+    Returns:
+        tuple: (response, None) or, on a connection error or timeout, (None, error message)
+    """
+    import requests
+
+    try:
+        with open(pdf_path, "rb") as f:
+            body = UploadReader(f, os.fstat(f.fileno()).st_size, progress)
+            return get_client().post("supervisions/upload", data=body), None
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        return None, str(e)
+
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_MAX_BACKOFF = 15 * 60
+# A drainer that hasn't checked in for this many seconds is presumed dead
+DRAIN_HEARTBEAT = 120
+# Statuses after which a queued upload is tried again (a rejected cookie is
+# renewed before the next round, if there is anyone to log in)
+OUTBOX_RETRY_STATUSES = TRANSIENT_STATUSES | AUTH_FAILURE_STATUSES
+OUTBOX_LOGIN_REQUIRED = "KuDoS login required, run 'kudos.py outbox --retry'"
+
+def upload_slot(directory):
+    """The slot a directory uploads to: its svuploadkey, or the directory itself if it has none"""
+    try:
+        with open(os.path.join(directory, INFOFILE_NAME), "r") as f:
+            match = SVUPLOADKEY_RE.search(f.read())
+    except FileNotFoundError:
+        match = None
+    return match.group(1) if match else os.path.abspath(directory)
+
+def outbox_dir():
+    """Where queued PDFs are snapshotted until they are uploaded"""
+    return os.path.join(server_dir(), "outbox")
+
+def outbox_log():
+    """Log of the background drainer"""
+    return os.path.join(server_dir(), "outbox.log")
+
+def _outbox_file(sha256):
+    return os.path.join(outbox_dir(), f"{sha256}.pdf")
+
+def _discard_snapshot(conn, sha256):
+    """Delete an outbox snapshot once no queued upload refers to it"""
+    if conn.execute("SELECT 1 FROM outbox WHERE sha256 = ?", (sha256,)).fetchone():
+        return
+    try:
+        os.unlink(_outbox_file(sha256))
+    except FileNotFoundError:
+        pass
+
+def queue_upload(conn, directory):
+    """
+    Queue the compiled PDF of a supervision directory for upload.
+
+    The PDF is snapshotted into the outbox, so later builds don't change
+    what gets sent, and it supersedes anything still queued for the same
+    slot.  A PDF identical to the last successful upload of the slot is not
+    queued at all.
+
+    Returns:
+        str: "queued", "unchanged" (already uploaded) or "missing" (no PDF)
+    """
+    pdf_path = os.path.join(directory, WORKFILE_NAME.replace(".tex", ".pdf"))
+    if not os.path.isfile(pdf_path):
+        print(f"Error: Compiled PDF not found: {pdf_path}")
+        return "missing"
+
+    sha256 = file_sha256(pdf_path)
+    slot = upload_slot(directory)
+    row = conn.execute("SELECT sha256 FROM uploaded WHERE slot = ?", (slot,)).fetchone()
+    unchanged = row is not None and row[0] == sha256
+
+    if not unchanged and not os.path.exists(_outbox_file(sha256)):
+        os.makedirs(outbox_dir(), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=outbox_dir(), suffix=".part", delete=False) as tmp:
+            with open(pdf_path, "rb") as f:
+                shutil.copyfileobj(f, tmp)
+        os.replace(tmp.name, _outbox_file(sha256))
+
+    def enqueue():
+        now = time.time()
+        with conn:
+            superseded = [r[0] for r in conn.execute(
+                "SELECT sha256 FROM outbox WHERE slot = ? AND sha256 != ?", (slot, sha256))]
+            conn.execute("DELETE FROM outbox WHERE slot = ? AND sha256 != ?", (slot, sha256))
+            if not unchanged:
+                # Re-queueing resets the attempt count, including of a failed upload
+                conn.execute("INSERT OR REPLACE INTO outbox (slot, sha256, directory, queued_at, next_attempt) "
+                             "VALUES (?, ?, ?, ?, ?)", (slot, sha256, directory, now, now))
+        return superseded
+
+    for old in retry_locked(enqueue):
+        _discard_snapshot(conn, old)
+    return "unchanged" if unchanged else "queued"
+
+def _drainer_alive(owner):
+    """Whether the process that claimed the outbox is still running, as far as we can tell"""
+    if os.name != "posix":
+        return True  # only the heartbeat to go on
+    try:
+        os.kill(int(owner.split("-")[0]), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _claim_drain(conn, token):
+    """
+    Become (or stay) the one process draining the outbox.
+
+    Returns:
+        bool: False if another drainer has checked in within DRAIN_HEARTBEAT
+    """
+    return retry_locked(_try_claim_drain, conn, token)
+
+def _try_claim_drain(conn, token):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        owner = _get_meta(conn, 'drain_owner')
+        heartbeat = float(_get_meta(conn, 'drain_heartbeat') or 0)
+        if (owner not in (None, token) and time.time() - heartbeat < DRAIN_HEARTBEAT
+                and _drainer_alive(owner)):
+            conn.rollback()
+            return False
+        _set_meta(conn, 'drain_owner', token)
+        _set_meta(conn, 'drain_heartbeat', str(time.time()))
+        conn.commit()
+        return True
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _release_drain(conn, token):
+    """
+    Stop draining, unless something was queued since the last look.
+
+    This is checked in the same transaction as the release, so an upload
+    queued while a drainer is finishing is either seen by it or by the
+    drainer started for it.
+
+    Returns:
+        bool: Whether the drain was released
+    """
+    return retry_locked(_try_release_drain, conn, token)
+
+def _try_release_drain(conn, token):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM outbox WHERE failed = 0").fetchone():
+            conn.commit()
+            return False
+        if _get_meta(conn, 'drain_owner') == token:
+            _set_meta(conn, 'drain_owner', None)
+        conn.commit()
+        return True
+    except BaseException:
+        conn.rollback()
+        raise
+
+def _record_attempt(conn, slot, sha256, directory, attempts, response, error, interactive=False):
+    """
+    Store the outcome of one upload attempt; returns 1 if it succeeded.
+
+    Without anyone to log in (interactive=False), a rejected cookie marks
+    the upload failed as needing a login rather than retrying it.
+    """
+    if response is not None and response.status_code == 200:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO uploaded VALUES (?, ?, ?)", (slot, sha256, time.time()))
+            conn.execute("DELETE FROM outbox WHERE slot = ? AND sha256 = ?", (slot, sha256))
+        _discard_snapshot(conn, sha256)
+        print(f"Uploaded {directory}")
+        return 1
+
+    if response is not None:
+        error = f"HTTP {response.status_code}"
+    attempts += 1
+    failed = attempts >= OUTBOX_MAX_ATTEMPTS or (
+        response is not None and response.status_code not in OUTBOX_RETRY_STATUSES)
+    if response is not None and not interactive and KuDoSClient.is_auth_failure(response):
+        failed, error = True, OUTBOX_LOGIN_REQUIRED
+    delay = min(UPLOAD_BACKOFF * 2 ** attempts, OUTBOX_MAX_BACKOFF)
+    with conn:
+        conn.execute("UPDATE outbox SET attempts = ?, next_attempt = ?, error = ?, failed = ? "
+                     "WHERE slot = ? AND sha256 = ?",
+                     (attempts, time.time() + delay, error, int(failed), slot, sha256))
+    if failed:
+        print(f"Giving up on {directory} after {attempts} attempt(s) ({error})")
+    else:
+        print(f"Upload of {directory} failed ({error}), retrying in {delay:g}s")
+    return 0
+
+def drain_outbox(conn, workers=UPLOAD_WORKERS, interactive=False, progress=False):
+    """
+    Upload everything in the outbox, retrying failures with backoff.
+
+    Runs until nothing is left to send; uploads that were rejected, or
+    failed OUTBOX_MAX_ATTEMPTS times, stay in the outbox marked failed.
+    Only one drainer runs at a time, so if another process is already
+    draining this returns straight away.
+
+    Args:
+        conn: Store connection
+        workers (int): Concurrent uploads
+        interactive (bool): Whether a login may be started if the cookie has
+            expired; otherwise (as in the detached drainer) such uploads are
+            marked failed as needing a login
+        progress (bool): Show progress while a single upload is in flight
+
+    Returns:
+        int: Number of PDFs uploaded
+    """
+    token = f"{os.getpid()}-{os.urandom(4).hex()}"
+    if not _claim_drain(conn, token):
+        return 0
+
+    uploaded = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                now = time.time()
+                due = conn.execute(
+                    "SELECT slot, sha256, directory, attempts FROM outbox "
+                    "WHERE failed = 0 AND next_attempt <= ? ORDER BY queued_at", (now,)).fetchall()
+                if not due:
+                    (next_attempt,) = conn.execute(
+                        "SELECT MIN(next_attempt) FROM outbox WHERE failed = 0").fetchone()
+                    if next_attempt is None and _release_drain(conn, token):
+                        break
+                    if next_attempt is not None:
+                        time.sleep(min(max(next_attempt - now, 0), DRAIN_HEARTBEAT / 4))
+                    if not _claim_drain(conn, token):
+                        break
+                    continue
+
+                client = get_client()
+                if interactive:
+                    # Bodies are streamed, so make sure the cookie is good before sending them
+                    client.ensure_authenticated()
+                elif client.reauthenticate is not None and client.is_expired():
+                    # Sending would start a browser login that nobody is there to complete
+                    with conn:
+                        conn.executemany("UPDATE outbox SET failed = 1, error = ? WHERE slot = ? AND sha256 = ?",
+                                         [(OUTBOX_LOGIN_REQUIRED, slot, sha256) for slot, sha256, _, _ in due])
+                    for _, _, directory, _ in due:
+                        print(f"Not uploading {directory} ({OUTBOX_LOGIN_REQUIRED})")
+                    continue
+                # Progress lines from concurrent uploads would overwrite each other
+                show_progress = progress and len(due) == 1
+                futures = {
+                    pool.submit(post_pdf, _outbox_file(sha256), show_progress): (slot, sha256, directory, attempts)
+                    for slot, sha256, directory, attempts in due
+                }
+                for future in as_completed(futures):
+                    slot, sha256, directory, attempts = futures[future]
+                    try:
+                        response, error = future.result()
+                    except OSError as e:
+                        # The snapshot is gone; there is nothing left to retry
+                        response, error, attempts = None, str(e), OUTBOX_MAX_ATTEMPTS
+                    uploaded += _record_attempt(conn, slot, sha256, directory, attempts, response, error,
+                                                interactive)
+                    if not _claim_drain(conn, token):
+                        return uploaded
+    finally:
+        with conn:
+            if _get_meta(conn, 'drain_owner') == token:
+                _set_meta(conn, 'drain_owner', None)
+    return uploaded
+
+def start_drain():
+    """
+    Drain the outbox in a detached background process that outlives this one.
+
+    Returns:
+        subprocess.Popen: The drainer, whose output goes to outbox_log()
+    """
+    # The drainer inherits KUDOS_BASE_URL (see set_base_url), so it drains this server's outbox
+    os.makedirs(server_dir(), exist_ok=True)
+    with open(outbox_log(), "a") as log:
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "outbox", "--drain"],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+def upload_in_background(directory):
+    """
+    Queue a directory's PDF and make sure the outbox is being drained.
+
+    Returns:
+        str: Status from queue_upload
+    """
+    conn = open_store()
+    try:
+        status = queue_upload(conn, directory)
+    finally:
+        conn.close()
+    if status == "queued":
+        start_drain()
+    return status
+
+def show_outbox(conn):
+    """Print the uploads still waiting in the outbox"""
+    rows = conn.execute("SELECT directory, attempts, next_attempt, error, failed FROM outbox "
+                        "ORDER BY queued_at").fetchall()
+    if not rows:
+        print("Outbox is empty.")
+        return
+    print(f"{'Directory':<30} {'Attempts':>8}  Status")
+    print("-" * 70)
+    for directory, attempts, next_attempt, error, failed in rows:
+        if failed:
+            status = f"failed: {error}"
+        elif attempts:
+            status = f"retry at {datetime.fromtimestamp(next_attempt):%H:%M:%S} ({error})"
+        else:
+            status = "pending"
+        print(f"{directory:<30} {attempts:>8}  {status}")
+
+def find_supervision_dirs(root="."):
+    """
+    Find all supervision working directories (<course>_<n>) under root.
+
+    Directories with a work.tex but no infofile.tex (their infofile
+    download failed) are reported and left out.
+
+    Returns:
+        list: Sorted directory paths that contain both work.tex and infofile.tex
+    """
+    directories = []
+    for path in sorted(Path(root).glob(f"*/{WORKFILE_NAME}")):
+        if slot_scaffolded(path.parent):
+            directories.append(str(path.parent))
+        else:
+            print(f"Skipping {path.parent}: no {INFOFILE_NAME}, run 'kudos.py prefetch' to fetch it")
+    return directories
+
+def build_directory(directory, preamble_cache=False, optimize=False):
+    """Refresh the infofile, compile and optionally optimise one supervision directory"""
+    if not process_infofile(directory):
+        return "infofile failed"
+    if is_up_to_date(directory, engine=select_engine(preamble_cache, directory)):
+        status = "up to date"
+    elif not compile_latex(directory, quiet=True, preamble_cache=preamble_cache):
+        return "compile failed"
+    else:
+        status = "compiled"
+    if optimize and not optimize_pdf(directory, quiet=True):
+        return "optimize failed"
+    return status
+
+def build_all(directories, jobs=None, upload=True, preamble_cache=False, optimize=False):
+    """
+    Compile (and upload) every supervision directory in parallel.
+
+    Tectonic runs are spread over a pool sized to the CPU count.  Each PDF
+    is queued in the upload outbox as soon as it is built, and a background
+    drainer sends it while the remaining compiles are still running.
+
+    Args:
+        directories (list): Supervision directories to build
+        jobs (int): Number of concurrent tectonic runs, defaults to the CPU count
+        upload (bool): Whether to upload each PDF after compiling it
+        preamble_cache (bool): Compile against the cached template preamble
+        optimize (bool): Shrink each PDF with optimize_pdf before uploading it
+
+    Returns:
+        dict: Final status for each directory
+    """
+    jobs = jobs or os.cpu_count() or 1
+    results = {}
+    # Build statuses, kept apart from results, where uploads overwrite them
+    built = {}
+    conn = open_store() if upload else None
+    drainer = None
+
+    get_client()  # read config.json (or log in) before the compile threads need it
+    with ThreadPoolExecutor(max_workers=jobs) as compile_pool:
+        builds = {compile_pool.submit(build_directory, d, preamble_cache, optimize): d for d in directories}
+        for future in as_completed(builds):
+            directory = builds[future]
+            try:
+                results[directory] = built[directory] = future.result()
+            except Exception as e:
+                results[directory] = built[directory] = f"error: {e}"
+                continue
+            if upload and results[directory] in ("compiled", "up to date"):
+                status = queue_upload(conn, directory)
+                results[directory] = {"queued": "upload queued", "unchanged": "already uploaded"}.get(status, status)
+                if status == "queued" and (drainer is None or drainer.poll() is not None):
+                    drainer = start_drain()
+    if conn is not None:
+        conn.close()
+
+    print("\nBuild summary:")
+    print("-" * 50)
+    for directory in directories:
+        print(f"{directory:<35} {results[directory]}")
+    print("-" * 50)
+    # Only directories that got as far as the cache check count as hits or misses
+    hits = sum(1 for status in built.values() if status == "up to date")
+    misses = sum(1 for status in built.values() if status in ("compiled", "compile failed"))
+    uncounted = len(directories) - hits - misses
+    print(f"Build cache: {hits} hit(s), {misses} miss(es)"
+          + (f", {uncounted} not counted (infofile, optimisation or other errors)" if uncounted else ""))
+    if optimize:
+        saved = sum(
+            entry['original_bytes'] - entry['bytes']
+            for entry in (_read_manifest(d).get('optimized') for d in directories) if entry
+        )
+        print(f"PDF optimisation saved {saved / 1e3:.0f} kB in total")
+    if drainer is not None:
+        print("Uploads continue in the background, see 'kudos.py outbox'.")
+    return results
+
+def _input_stats(directory, names):
+    """(mtime, size) of each input file, so polling never has to read contents"""
+    stats = {}
+    for name in names:
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        stats[name] = (st.st_mtime_ns, st.st_size)
+    return stats
+
+def watch(directory, debounce=DEFAULT_DEBOUNCE, upload=False, interval=WATCH_INTERVAL,
+          preamble_cache=False, optimize=False):
+    """
+    Recompile a supervision directory whenever one of its inputs is saved.
+
+    Watches work.tex and everything it pulls in (infofile.tex and the
+    template/ files) by polling file stats.  A build starts once the files
+    have been quiet for `debounce` seconds, so an editor writing several
+    files, or several saves in a row, triggers a single compile.
+
+    Args:
+        directory (str): Supervision directory to watch
+        debounce (float): Seconds without changes before rebuilding
+        upload (bool): Queue an upload of each successful build in the outbox
+        interval (float): Seconds between polls
+        preamble_cache (bool): Compile against the cached template preamble
+        optimize (bool): Shrink each PDF with optimize_pdf before queueing its upload
+    """
+    if not os.path.isfile(os.path.join(directory, WORKFILE_NAME)):
+        print(f"Error: {WORKFILE_NAME} not found in {directory}")
+        return
+
+    print(f"Watching {directory} for changes (Ctrl-C to stop)...")
+    names = latex_dependencies(directory)
+    stats = _input_stats(directory, names)
+    changed_at = time.monotonic() - debounce  # build once straight away
+
+    try:
+        while True:
+            if changed_at is not None and time.monotonic() - changed_at >= debounce:
+                changed_at = None
+                # The outbox keeps its own copy of the PDF, so rebuilding
+                # never disturbs an upload that is still in flight
+                if compile_latex(directory, preamble_cache=preamble_cache) and upload:
+                    if optimize:
+                        optimize_pdf(directory)
+                    if upload_in_background(directory) == "queued":
+                        print("Upload queued.")
+                # work.tex may have gained or lost \input files.  Edits made
+                # during the build still differ from `stats` and are picked up
+                names = latex_dependencies(directory)
+
+            time.sleep(interval)
+            current = _input_stats(directory, names)
+            if current != stats:
+                stats = current
+                changed_at = time.monotonic()
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+
+def find_student_by_crsid(course_entry, target_crsid):
+    """
+    Find student details in the supervision entry matching the CRSID.
+    Returns None if not found.
+    """
+    for supervisee in course_entry['supervisees']:
+        if supervisee['user']['CRSID'] == target_crsid:
+            return supervisee['user']
+    return None
+
+def fetch_booking(course_entry, slot_idx, synthesise_slot, student=None):
+    """
+    Set up supervision working directory and fetch or create info file.
+    
+    Args:
+        course_entry: The supervision entry containing all supervision details
+        slot_idx: The index of the slot (0-based)
+        synthesise_slot: Boolean indicating if this is a synthetic slot
+        student: The user's supervisee details, looked up by CRSID if not given
+    """
+    # Load config and get CRSID
+    config = load_config()
     student_crsid = config['crsid']
     
     # Find student details
-    student = find_student_by_crsid(course_entry, student_crsid)
+    if student is None:
+        student = find_student_by_crsid(course_entry, student_crsid)
     if not student:
         raise ValueError(f"Student with CRSID {student_crsid} not found in supervision group")
     
-    # Extract course name from the first group entry
-    course_name = course_entry['group'][0]['course']
-    
-    # Create directory name (1-indexed slot number)
-    dir_name = f"{course_name}_{slot_idx + 1}"
+    dir_name = slot_dir_name(course_entry, slot_idx)
     
     # Create directory if it doesn't exist
 
-    if os.path.exists(dir_name):
+    if slot_scaffolded(dir_name):
         if (input("Path exists, compile and upload to KuDoS (y/n)?") == "y"):
             if process_infofile(dir_name):
-                if compile_latex(dir_name):
-                    upload_pdf(dir_name)
+                if compile_latex(dir_name, preamble_cache=config.get('preamble_cache', False)):
+                    if config.get('optimize', False):
+                        optimize_pdf(dir_name)
+                    status = upload_in_background(dir_name)
+                    if status == "queued":
+                        print("PDF queued for upload, it will be sent in the background "
+                              "(see 'kudos.py outbox').")
+                    elif status == "unchanged":
+                        print("PDF is unchanged since it was last uploaded.")
         return
     
-    os.makedirs(dir_name, exist_ok=True)
-    # Copy template file
-    template_path = Path("template/perSV_mywork.tex")
-    if not template_path.exists():
-        raise FileNotFoundError("Template file not found: template/perSV_mywork.tex")
-    
-    shutil.copy(template_path, Path(dir_name) / "work.tex")
+    create_slot_dir(dir_name)
     
     if synthesise_slot:
         create_synthetic_info(course_entry, slot_idx + 1, dir_name, student)
     else:
         fetch_remote_info(course_entry, slot_idx, dir_name)
 
-def create_synthetic_info(course_entry, slot_num, dir_name, student):
+def slot_dir_name(course_entry, slot_idx):
+    """Working directory name for a slot: <course>_<n>, 1-indexed"""
+    # Extract course name from the first group entry
+    course_name = course_entry['group'][0]['course']
+    return f"{course_name}_{slot_idx + 1}"
+
+WORK_TEMPLATE = "template/perSV_mywork.tex"
+INFOFILE_TEMPLATE = "template/infofile.tex"
+PLACEHOLDER_RE = re.compile(r"\$\$([A-Z_]+)\$\$")
+LATEX_ESCAPES = str.maketrans({
+    "\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#",
+    "_": r"\_", "{": r"\{", "}": r"\}", "~": r"\textasciitilde{}", "^": r"\textasciicircum{}",
+})
+
+def latex_escape(text):
+    """Escape the characters LaTeX treats specially, for names and titles"""
+    return str(text).translate(LATEX_ESCAPES)
+
+@functools.lru_cache(maxsize=None)
+def _read_template(path):
+    with open(path, "r") as f:
+        return f.read()
+
+@functools.lru_cache(maxsize=None)
+def compile_template(path):
+    """
+    Parse a $$PLACEHOLDER$$ template once.
+
+    Returns:
+        tuple: Alternating literal text and placeholder names, starting and
+        ending with literal text
+    """
+    try:
+        return tuple(PLACEHOLDER_RE.split(_read_template(path)))
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Template file not found: {path}")
+
+def render_template(path, values):
+    """
+    Fill in a $$PLACEHOLDER$$ template.
+
+    Values are inserted as given, so anything that isn't LaTeX yet must be
+    passed through latex_escape first.
+
+    Raises:
+        ValueError: If the template uses a placeholder missing from values
+    """
+    parts = compile_template(path)
+    try:
+        return "".join(
+            part if i % 2 == 0 else str(values[part])
+            for i, part in enumerate(parts)
+        )
+    except KeyError as e:
+        raise ValueError(f"No value for $${e.args[0]}$$ in {path}") from None
+
+def slot_scaffolded(dir_name):
+    """
+    Whether a slot directory is complete.  One whose infofile download
+    failed has a work.tex but no infofile.tex, and is scaffolded again.
+    """
+    return os.path.isfile(os.path.join(dir_name, INFOFILE_NAME))
+
+def create_slot_dir(dir_name):
+    """
+    Create a slot working directory holding a fresh copy of the work template.
+
+    An existing work.tex (from an earlier, incomplete scaffold) is kept.
+    """
+    try:
+        work = _read_template(WORK_TEMPLATE)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Template file not found: {WORK_TEMPLATE}")
+
+    os.makedirs(dir_name, exist_ok=True)
+    work_path = Path(dir_name) / WORKFILE_NAME
+    if not work_path.exists():
+        with open(work_path, "w") as f:
+            f.write(work)
+
+def scaffold_slots(filtered_supervisions, concurrency=DEFAULT_PREFETCH_CONCURRENCY, unbooked=False):
+    """
+    Scaffold a directory for every slot in one pass.
+
+    Booked slots get their infofile from KuDoS, fetched concurrently.  With
+    `unbooked`, the remaining unbooked slots get a synthetic infofile
+    rendered from the template.  Slots already scaffolded are left alone;
+    a directory left without an infofile by a failed download is retried.  The templates are read once, and the directories and
+    synthetic infofiles are all written before any download starts.  Downloads
+    share the pooled client and run at most `concurrency` at a time, so the
+    whole term costs roughly one round-trip instead of one per slot.
+
+    Args:
+        filtered_supervisions (SupervisionIndex): Supervisions to scaffold
+        concurrency (int): Maximum number of infofile downloads in flight
+        unbooked (bool): Also scaffold slots that aren't booked yet
+
+    Returns:
+        dict: True/False fetch result for each newly scaffolded booked slot
+    """
+    crsid = load_config()['crsid'] if unbooked else None
+    booked, synthetic = [], []
+    planned = set()
+    for supervision in filtered_supervisions:
+        student = supervision.students.get(crsid)
+        last_slot = supervision.total_slots if unbooked else supervision.booked_slots
+        for slot_idx in range(last_slot):
+            dir_name = slot_dir_name(supervision.raw, slot_idx)
+            # Directories are named by course, so two groups can map to the same one
+            if dir_name in planned or slot_scaffolded(dir_name):
+                continue
+            planned.add(dir_name)
+            if slot_idx < supervision.booked_slots:
+                booked.append((supervision.raw, slot_idx, dir_name))
+            elif student is not None:
+                synthetic.append((supervision.raw, slot_idx, dir_name, student))
+
+    with span("scaffold_slots", booked=len(booked), synthetic=len(synthetic)):
+        for _, _, dir_name in booked:
+            create_slot_dir(dir_name)
+        for course_entry, slot_idx, dir_name, student in synthetic:
+            create_slot_dir(dir_name)
+            create_synthetic_info(course_entry, slot_idx + 1, dir_name, student, quiet=True)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(fetch_remote_info, supervision, slot_idx, dir_name): dir_name
+            for supervision, slot_idx, dir_name in booked
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    print(f"\nPrefetched {sum(results.values())} of {len(booked)} new booked slot(s).")
+    for dir_name in sorted(results):
+        if not results[dir_name]:
+            print(f"  Failed: {dir_name}")
+    if unbooked:
+        print(f"Created {len(synthetic)} new unbooked slot(s).")
+    return results
+
+def create_synthetic_info(course_entry, slot_num, dir_name, student, quiet=False):
     """
     Create a synthetic info file for slots that don't exist yet.
+
+    The file is rendered from template/infofile.tex.  Names and course
+    details are LaTeX-escaped; the upload URL is left as it is.
     """
-    # Get supervisor details
     supervisor = course_entry['supervisor']
-    supervisor_name = f"{supervisor['title']} {supervisor['firstName']} {supervisor['lastName']}"
-    
-    # Format student name
-    student_name = f"{student['title']} {student['firstName']} {student['lastName']}"
-    student_crsid = student['CRSID']
-    
-    # Get course name
-    course_name = course_entry['group'][0]['course']
-    supervisor_crsid = course_entry['supervisor']['CRSID']
-    group_id = course_entry['groupNumber']
-    
-    url = f"https://kudos.chu.cam.ac.uk/kudos/rest/supervisions/infofile/{supervisor_crsid}/{group_id}/{slot_num}"
-    
-    # Create info file content
-    info_content = f"""\\newcommand{{\\svcourse}}{{{course_name}}}
-\\newcommand{{\\svnumber}}{{{slot_num}}}
-\\newcommand{{\\svvenue}}{{}}
-\\newcommand{{\\svdate}}{{}}
-\\newcommand{{\\svtime}}{{}}
-\\newcommand{{\\svuploadkey}}{{{url}}}
-
-\\newcommand{{\\svrname}}{{{supervisor_name}}}
-\\newcommand{{\\jkfside}}{{oneside}}
-\\newcommand{{\\jkfhanded}}{{right}}
-
-\\newcommand{{\\studentname}}{{{student_name}}}
-\\newcommand{{\\studentemail}}{{{student_crsid}}}
-"""
-    
+    group = course_entry['group'][0]
+    info_content = render_template(INFOFILE_TEMPLATE, {
+        'TRIPOS': latex_escape(group['tripos']),
+        'COURSE': latex_escape(group['course']),
+        'SVNUM': slot_num,
+        'VENUE': "",
+        'SVDATE': "",
+        'SVTIME': "",
+        'SVUPLOADKEY': infofile_url(course_entry, slot_num),
+        'SVR_NAME': latex_escape(f"{supervisor['title']} {supervisor['firstName']} {supervisor['lastName']}"),
+        'SVR_PAPER_SIDED': "oneside",
+        'SVR_PAPER_HANDED': "right",
+        'STU_NAME': latex_escape(f"{student['title']} {student['firstName']} {student['lastName']}"),
+        'STU_EMAIL': latex_escape(student['CRSID']),
+    })
+
     # Write info file
-    info_path = Path(dir_name) / "infofile.tex"
+    info_path = Path(dir_name) / INFOFILE_NAME
     with open(info_path, 'w') as f:
         f.write(info_content)
-    
-    print(f"Created synthetic info file in {dir_name}")
+
+    if not quiet:
+        print(f"Created synthetic info file in {dir_name}")
 
 def fetch_remote_info(course_entry, slot_idx, dir_name):
     """
     Fetch info file from remote server for existing bookings.
     """
-    supervisor_crsid = course_entry['supervisor']['CRSID']
-    group_id = course_entry['groupNumber']
-    
-    url = f"https://kudos.chu.cam.ac.uk/kudos/rest/supervisions/infofile/{supervisor_crsid}/{group_id}/{slot_idx + 1}"
-    config = load_config()
+    import requests
+
+    url = infofile_url(course_entry, slot_idx + 1)
     try:
-        response = requests.get(url, cookies={"KuDoSAuth": config['auth']})
+        response = prefetched_or_call(url, get_client().get, url)
         response.raise_for_status()
         
         # Write the fetched content to infotile.tex
@@ -365,10 +2215,12 @@ def fetch_remote_info(course_entry, slot_idx, dir_name):
             f.write(response.text)
         
         print(f"Fetched remote info file to {dir_name}")
+        return True
         
     except requests.exceptions.RequestException as e:
         print(f"Error fetching info file: {e}")
         print("You may need to authenticate or check your connection.")
+        return False
 
 def get_unique_courses(filtered_supervisions):
     """Extract unique courses from the supervision list"""
@@ -390,10 +2242,15 @@ def calculate_available_slots(supervision):
     return total_slots + additional_slots
 
 def select_supervision_slot(filtered_supervisions):
-    """Interactive function to select a course and supervision slot"""
+    """
+    Interactive function to select a course and supervision slot
+
+    Args:
+        filtered_supervisions (SupervisionIndex): Supervisions to offer
+    """
     
     # Get unique courses
-    courses = get_unique_courses(filtered_supervisions)
+    courses = filtered_supervisions.courses
     
     # Display course options
     print("\nAvailable courses:")
@@ -413,46 +2270,34 @@ def select_supervision_slot(filtered_supervisions):
         except ValueError:
             print("Please enter a valid number.")
     
-    # Filter supervisions for selected course
-    course_supervisions = [
-        sup for sup in filtered_supervisions
-        if any(g['course'] == selected_course[0] for g in sup['group'])
-    ]
+    # Supervisions for selected course
+    course_supervisions = filtered_supervisions.for_course(selected_course[0])
     
     # Display supervision options
     print("\nAvailable supervisions:")
     for sup_idx, supervision in enumerate(course_supervisions):
-        supervisor = supervision['supervisor']['name']
-        booked_slots = [
-            f"Slot {idx + 1}: {booking['startTime']} at {booking['venue']}"
-            for idx, booking in enumerate(supervision['bookings'])
-        ]
-        
-        total_booked = sum(b['duration'] for b in supervision['bookings'])
-        remaining_minutes = supervision['minutesAllocated'] - total_booked
-        additional_slots = remaining_minutes // 60
-        
-        print(f"\nSupervision Group {supervision['groupNumber']} with {supervisor}:")
-        for slot in booked_slots:
-            print(f"  {slot}")
+        print(f"\nSupervision Group {supervision.group_number} with {supervision.supervisor_name}:")
+        for idx, booking in enumerate(supervision.bookings):
+            print(f"  Slot {idx + 1}: {booking['startTime']} at {booking['venue']}")
         
-        if additional_slots > 0:
-            print(f"  {additional_slots} additional unbooked slot(s) available")
+        if supervision.additional_slots > 0:
+            print(f"  {supervision.additional_slots} additional unbooked slot(s) available")
     
     # Get supervision and slot selection
     while True:
         try:
             if True:
                 selected_supervision = course_supervisions[0]
-                max_slots = calculate_available_slots(selected_supervision)
+                max_slots = selected_supervision.total_slots
                 
                 slot_idx = int(input(f"\nSelect slot number (1-{max_slots}): ")) - 1
                 if 0 <= slot_idx < max_slots:
                     # Determine if this is a synthetic slot
-                    is_synthetic = slot_idx >= len(selected_supervision['bookings'])
+                    is_synthetic = slot_idx >= selected_supervision.booked_slots
+                    student = selected_supervision.students.get(load_config()['crsid'])
                     
                     # Call the booking function
-                    fetch_booking(selected_supervision, slot_idx, is_synthetic)
+                    fetch_booking(selected_supervision.raw, slot_idx, is_synthetic, student)
                     break
                 print(f"Invalid slot number. Please choose between 1 and {max_slots}.")
             else:
@@ -461,64 +2306,120 @@ def select_supervision_slot(filtered_supervisions):
             print("Please enter valid numbers.")
     return False
 
-import requests
-from datetime import datetime
-
-def fetch_supervisions():
-    """Fetch supervisions from the API"""
-    config = load_config()
-    url = "https://kudos.chu.cam.ac.uk/kudos/rest/supervisions/upload-marked"
-    try:
-        response = requests.get(url, cookies={"KuDoSAuth": config['auth']})
-        response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Error fetching data: {e}")
-        return []
-
-
-def filter_recent_supervisions(supervisions):
-    """Filter supervisions to last 4 weeks"""
-    four_weeks_ago = datetime.now(timezone.utc) - timedelta(weeks=4)
+def filter_recent_supervisions(supervisions, weeks=DEFAULT_MARKED_WINDOW_WEEKS):
+    """Filter supervisions to last `weeks` weeks (4 by default)"""
+    cutoff = datetime.now(timezone.utc) - timedelta(weeks=weeks)
     return [
         sv for sv in supervisions 
-        if parse_datetime(sv['start']) > four_weeks_ago
+        if parse_datetime(sv['start']) > cutoff
     ]
 
-def display_supervisions(supervisions):
-    """Display supervisions and return them sorted by date"""
-    # Sort supervisions by date (newest last)
-    sorted_supervisions = sorted(
-        supervisions,
-        key=lambda x: parse_datetime(x['start'])
-    )
-    
-    # Print header
-    print("\nSupervisions (newest at bottom):")
-    print("-" * 80)
-    print(f"{'Index':<6} {'Date':<25} {'CRSID':<10} {'Supervisor':<10} {'Group':<6} {'SV#':<4} {'Status'}")
-    print("-" * 80)
-    
-    # Print each supervision
-    for idx, sv in enumerate(sorted_supervisions):
-        status = "Failed" if sv['failed'] else "Success"
-        print(f"{idx:<6} {sv['start']:<25} {sv['CRSID']:<10} "
-              f"{sv['supervisorCRSID']:<10} {sv['groupNumber']:<6} "
-              f"{sv['svNumber']:<4} {status}")
-    
-    return sorted_supervisions
+MARKED_HEADER = f"{'Index':<6} {'Date':<25} {'CRSID':<10} {'Supervisor':<10} {'Group':<6} {'SV#':<4} {'Status'}"
+
+def _marked_row(idx, sv):
+    status = "Failed" if sv['failed'] else "Success"
+    return (f"{idx:<6} {sv['start']:<25} {sv['CRSID']:<10} "
+            f"{sv['supervisorCRSID']:<10} {sv['groupNumber']:<6} "
+            f"{sv['svNumber']:<4} {status}")
+
+class MarkedIndex:
+    """
+    Prefix search over marked work, built once per listing.
+
+    Every entry contributes the search terms for its CRSID, supervisor,
+    group number, SV number ("sv2") and status ("failed"/"success") to one
+    sorted list, so a term is a bisect plus a scan over just its matches.
+    """
+
+    __slots__ = ("entries", "terms", "ids")
+
+    def __init__(self, entries):
+        self.entries = entries
+        terms, ids = [], []
+        for idx, sv in enumerate(entries):
+            entry_terms = (
+                str(sv['CRSID']).lower(), str(sv['supervisorCRSID']).lower(),
+                str(sv['groupNumber']), f"sv{sv['svNumber']}",
+                "failed" if sv['failed'] else "success",
+            )
+            terms += entry_terms
+            ids += (idx,) * len(entry_terms)
+        # Sorting positions by term is much cheaper than sorting (term, idx) tuples
+        order = sorted(range(len(terms)), key=terms.__getitem__)
+        self.terms = [terms[i] for i in order]
+        self.ids = [ids[i] for i in order]
+
+    def matching(self, prefix):
+        """Indices of the entries with a term starting with prefix"""
+        lo = bisect.bisect_left(self.terms, prefix)
+        hi = lo
+        while hi < len(self.terms) and self.terms[hi].startswith(prefix):
+            hi += 1
+        return set(self.ids[lo:hi])
+
+    def search(self, query):
+        """
+        Indices of the entries matching every word of query, in listing order.
+        """
+        words = query.lower().split()
+        if not words:
+            return list(range(len(self.entries)))
+        # Intersect from the smallest match set, so the cost follows the results
+        matches = sorted((self.matching(word) for word in words), key=len)
+        result = matches[0].intersection(*matches[1:])
+        return sorted(result)
+
+def marked_page_size():
+    """Rows that fit on the terminal alongside the header and prompt"""
+    return max(shutil.get_terminal_size().lines - 8, 5)
+
+def browse_marked(entries, page_size=None):
+    """
+    Page through marked work, oldest first, and pick an entry.
+
+    Only the visible page is rendered.  The view starts on the newest page;
+    Enter/n and p move between pages, "/words" narrows the listing to
+    entries matching every word (a prefix of a CRSID, supervisor, group,
+    "sv<n>" or "failed"), "/" alone clears the search, and q quits.
+    Index numbers stay the same whatever is being shown.
+
+    Returns:
+        dict: The selected entry, or None if the user quit
+    """
+    index = MarkedIndex(entries)
+    page_size = page_size or marked_page_size()
+    results = list(range(len(entries)))
+    query = ""
+    page = max((len(results) - 1) // page_size, 0)
 
-def select_supervision(supervisions):
-    """Get user selection via input"""
     while True:
-        try:
-            print("\nEnter the index number of the supervision you want to view:")
-            idx = int(input("> "))
-            if 0 <= idx < len(supervisions):
-                return supervisions[idx]
-            print(f"Please enter a number between 0 and {len(supervisions)-1}")
-        except ValueError:
-            print("Please enter a valid number")
+        pages = max((len(results) + page_size - 1) // page_size, 1)
+        page = min(max(page, 0), pages - 1)
+        print("\nSupervisions (newest at bottom):" + (f"  search: {query}" if query else ""))
+        print("-" * 80)
+        print(MARKED_HEADER)
+        print("-" * 80)
+        for idx in results[page * page_size:(page + 1) * page_size]:
+            print(_marked_row(idx, entries[idx]))
+        print("-" * 80)
+        print(f"Page {page + 1}/{pages}, {len(results)} of {len(entries)} entries. "
+              "Index to open, Enter/n next, p previous, /words search, q quit")
+
+        command = input("> ").strip()
+        if command in ("", "n"):
+            page += 1
+        elif command == "p":
+            page -= 1
+        elif command == "q":
+            return None
+        elif command.startswith("/"):
+            query = command[1:].strip()
+            results = index.search(query)
+            page = max((len(results) - 1) // page_size, 0)
+        elif command.isdigit() and int(command) < len(entries):
+            return entries[int(command)]
+        else:
+            print(f"Please enter an index between 0 and {len(entries) - 1}, or a command")
 
 def open_url(url):
     """Open URL using system commands"""
@@ -533,50 +2434,589 @@ def parse_date(date_str):
     """Parse date string to datetime object"""
     return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
 
-def main2():
-    # Fetch data
-    supervisions = fetch_supervisions()
+DEFAULT_ARCHIVE_JOBS = 6
+# Seconds SQLite waits for another connection's write lock, and how many
+# times retry_locked starts over after that.  Writers only hold the lock for
+# short transactions (store_marked spools the download first).
+STORE_BUSY_TIMEOUT = 5
+STORE_LOCK_RETRIES = 6
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS marked (
+    uuid TEXT PRIMARY KEY,
+    start_ts REAL NOT NULL,        -- parsed start time, Unix seconds
+    crsid TEXT,
+    supervisor TEXT,
+    group_number INTEGER,
+    sv_number INTEGER,
+    failed INTEGER NOT NULL,
+    digest TEXT NOT NULL,          -- hash of the entry, to spot changed rows
+    raw TEXT NOT NULL              -- the entry as served, as JSON
+);
+CREATE INDEX IF NOT EXISTS marked_by_start ON marked (start_ts);
+CREATE INDEX IF NOT EXISTS marked_by_supervisor ON marked (supervisor, group_number, start_ts);
+CREATE INDEX IF NOT EXISTS marked_by_group ON marked (group_number, start_ts);
+CREATE INDEX IF NOT EXISTS marked_by_failed ON marked (failed, start_ts);
+CREATE TABLE IF NOT EXISTS outbox (
+    slot TEXT NOT NULL,            -- svuploadkey of the slot (its directory if it has none)
+    sha256 TEXT NOT NULL,          -- hash of the queued PDF, names its snapshot under outbox_dir()
+    directory TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,    -- Unix seconds, pushed back after each failure
+    error TEXT,                    -- why the last attempt failed
+    failed INTEGER NOT NULL DEFAULT 0,  -- given up on until retried by hand
+    PRIMARY KEY (slot, sha256)
+);
+CREATE TABLE IF NOT EXISTS uploaded (
+    slot TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,          -- hash of the last PDF KuDoS accepted for the slot
+    uploaded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archive (
+    uuid TEXT PRIMARY KEY,         -- upload-marked entry
+    sha256 TEXT NOT NULL,          -- content hash, names the file under archive_dir()
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+def store_path():
+    """The local SQLite store of the KuDoS server in use"""
+    return os.path.join(server_dir(), "kudos.sqlite3")
+
+def archive_dir():
+    """Where archived marked PDFs are kept, by content hash"""
+    return os.path.join(server_dir(), "archive")
+
+def open_store(path=None):
+    """Open (creating if needed) the local SQLite store, by default store_path()"""
+    path = path or store_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=STORE_BUSY_TIMEOUT)
+    retry_locked(conn.executescript, STORE_SCHEMA)
+    return conn
+
+def retry_locked(fn, *args):
+    """
+    Run a store transaction, retrying it while another process (a sync, a
+    build or the drainer) holds the write lock for longer than STORE_BUSY_TIMEOUT.
+    """
+    for attempt in range(STORE_LOCK_RETRIES):
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == STORE_LOCK_RETRIES - 1:
+                raise
+
+def _get_meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+def store_marked(conn, entries):
+    """
+    Bring the marked table in line with a full upload-marked listing.
+
+    Only rows that are new or whose content changed are written, and rows
+    the server no longer lists are removed.  `entries` can be a network
+    stream: the changed rows are spooled to a temporary file as it arrives,
+    and only then applied in one short transaction, so the store's write
+    lock (which the outbox shares) is never held for a whole download.
+
+    Returns:
+        int: Number of rows inserted, updated or deleted
+    """
+    known = dict(conn.execute("SELECT uuid, digest FROM marked"))
+    changed = 0
+
+    with tempfile.TemporaryFile() as spool:
+        for entry in entries:
+            raw = json.dumps(entry, sort_keys=True, separators=(",", ":"))
+            digest = hashlib.sha1(raw.encode()).hexdigest()
+            if known.pop(entry['uuid'], None) == digest:
+                continue
+            changed += 1
+            pickle.dump((
+                entry['uuid'], parse_datetime(entry['start']).timestamp(), entry.get('CRSID'),
+                entry.get('supervisorCRSID'), entry.get('groupNumber'), entry.get('svNumber'),
+                int(bool(entry.get('failed'))), digest, raw,
+            ), spool, pickle.HIGHEST_PROTOCOL)
+
+        def spooled_rows():
+            spool.seek(0)
+            for _ in range(changed):
+                yield pickle.load(spool)
+
+        def apply():
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO marked VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 spooled_rows())
+                # Whatever is left in `known` has disappeared from the server
+                conn.executemany("DELETE FROM marked WHERE uuid = ?", ((uuid,) for uuid in known))
+
+        retry_locked(apply)
+    return changed + len(known)
+
+def sync_marked(conn, offline=False, quiet=False, renew=True):
+    """
+    Incrementally sync the local marked-work store with KuDoS.
+
+    The listing is requested conditionally (If-None-Match/If-Modified-Since),
+    so if nothing changed the server answers 304 and no rows are touched.
+    If KuDoS can't be reached, the local store is used as it is.  quiet
+    leaves out the warnings, for syncing in the background.
+
+    With renew=False no login is ever started: a rejected cookie raises
+    PermissionError instead, as in prefetch_get, so the caller can leave
+    logging in to the foreground.
+
+    Returns:
+        bool: Whether the store is now in line with KuDoS (False if it
+        could not be synced and is being used as it is)
+    """
+    import requests
+
+    if offline:
+        return True
+
+    headers = {}
+    etag = _get_meta(conn, 'marked_etag')
+    last_modified = _get_meta(conn, 'marked_last_modified')
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    try:
+        response = get_client().get("supervisions/upload-marked", headers=headers, stream=True, renew=renew)
+    except requests.exceptions.RequestException as e:
+        if not quiet:
+            print(f"Warning: could not reach KuDoS ({e}), showing locally stored marked work")
+        return False
+
+    with response:
+        if not renew and KuDoSClient.is_auth_failure(response):
+            raise PermissionError(f"KuDoS rejected the cookie (HTTP {response.status_code})")
+        if response.status_code == 304:
+            return True
+        if response.status_code != 200:
+            if not quiet:
+                print(f"Error fetching data: HTTP {response.status_code}")
+            return False
+
+        # Entries are decoded and spooled as the listing downloads, and only
+        # stored once it is complete, so a broken-off download changes nothing
+        try:
+            with span("store_marked") as s:
+                s['changed'] = store_marked(conn, iter_json_array(iter_body(response)))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if not quiet:
+                print(f"Warning: download of marked work failed ({e}), showing locally stored marked work")
+            return False
+    with conn:
+        _set_meta(conn, 'marked_etag', response.headers.get('ETag'))
+        _set_meta(conn, 'marked_last_modified', response.headers.get('Last-Modified'))
+    return True
+
+def query_marked(conn, since=None, until=None, supervisor=None, group=None, failed=None):
+    """
+    Look up stored marked work, oldest first.
+
+    Args:
+        since (datetime): Only work starting after this time
+        until (datetime): Only work starting before this time
+        supervisor (str): Only work for this supervisor CRSID
+        group (int): Only work for this group number
+        failed (bool): Only failed (True) or successful (False) uploads
+
+    Returns:
+        list: upload-marked entries
+    """
+    clauses, params = [], []
+    if since is not None:
+        clauses.append("start_ts > ?")
+        params.append(since.timestamp())
+    if until is not None:
+        clauses.append("start_ts < ?")
+        params.append(until.timestamp())
+    if supervisor is not None:
+        clauses.append("supervisor = ?")
+        params.append(supervisor)
+    if group is not None:
+        clauses.append("group_number = ?")
+        params.append(group)
+    if failed is not None:
+        clauses.append("failed = ?")
+        params.append(int(failed))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = conn.execute(f"SELECT raw FROM marked {where} ORDER BY start_ts", params)
+    return [json.loads(raw) for raw, in rows]
+
+def archive_path(sha256):
+    """Location of an archived PDF, sharded by the first two hex digits of its hash"""
+    return os.path.join(archive_dir(), sha256[:2], f"{sha256}.pdf")
+
+def archived_copy(conn, uuid):
+    """Path of the local copy of a marked PDF, or None if it is not archived"""
+    row = conn.execute("SELECT sha256 FROM archive WHERE uuid = ?", (uuid,)).fetchone()
+    if row and os.path.isfile(archive_path(row[0])):
+        return archive_path(row[0])
+    return None
+
+def download_marked(uuid):
+    """
+    Download one marked PDF into the content-addressed archive.
+
+    The body is streamed to a temporary file and hashed on the way, then
+    moved to its hash-named location (or dropped if that content is already
+    stored under another entry).
+
+    Returns:
+        tuple: (sha256, size)
+    """
+    os.makedirs(archive_dir(), exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    response = get_client().get(f"supervisions/upload-marked/{uuid}", stream=True)
+    with response:
+        response.raise_for_status()
+        with tempfile.NamedTemporaryFile(dir=archive_dir(), suffix=".part", delete=False) as f:
+            try:
+                for chunk in iter_body(response):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+
+    sha256 = digest.hexdigest()
+    path = archive_path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(f.name)
+    else:
+        os.replace(f.name, path)
+    return sha256, size
+
+def archive_marked(conn, entries, jobs=DEFAULT_ARCHIVE_JOBS):
+    """
+    Download every marked PDF in `entries` that isn't archived yet.
+
+    Downloads run on a bounded pool of `jobs` workers sharing the pooled
+    client; the archive index is only written from the calling thread.
+
+    Returns:
+        dict: Counts of "downloaded", "skipped" (already archived) and "failed" entries
+    """
+    counts = {"downloaded": 0, "skipped": 0, "failed": 0}
+    pending = []
+    for entry in entries:
+        if entry['failed']:
+            continue  # failed uploads have no marked PDF
+        if archived_copy(conn, entry['uuid']):
+            counts["skipped"] += 1
+        else:
+            pending.append(entry['uuid'])
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(download_marked, uuid): uuid for uuid in pending}
+        for future in as_completed(futures):
+            uuid = futures[future]
+            try:
+                sha256, size = future.result()
+            except Exception as e:
+                print(f"Error downloading {uuid}: {e}")
+                counts["failed"] += 1
+                continue
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?)",
+                             (uuid, sha256, size, time.time()))
+            counts["downloaded"] += 1
+            print(f"Archived {counts['downloaded']}/{len(pending)}", end="\r", flush=True)
+
+    if counts["downloaded"]:
+        print()
+    print(f"Archive: {counts['downloaded']} downloaded, {counts['skipped']} already archived, "
+          f"{counts['failed']} failed.")
+    return counts
+
+def marked_window(offline=False, weeks=None, since=None):
+    """
+    Start of the marked-work date range: `since`, or `weeks` ago.
+
+    The window is the same online and offline; offline, config.json is only
+    read if it exists, so no login is started.
+    """
+    if since is not None:
+        return since
+    if weeks is None:
+        weeks = DEFAULT_MARKED_WINDOW_WEEKS
+        if not offline or os.path.exists('config.json'):
+            weeks = load_config().get('marked_window_weeks', weeks)
+    return datetime.now(timezone.utc) - timedelta(weeks=weeks)
+
+def main2(offline=False, weeks=None, **filters):
+    # Sync the local store (or wait for the background sync), then query it
+    conn = open_store()
+    prefetched_or_call("marked", sync_marked, conn, offline)
+    since = marked_window(offline, weeks, filters.pop('since', None))
+    supervisions = query_marked(conn, since=since, **filters)
     if not supervisions:
+        print("No marked work found.")
+        conn.close()
         return
     
-    # Display table
-    sorted_supervisions = display_supervisions(filter_recent_supervisions(supervisions))
-    
-    # Select supervision
-    selected = select_supervision(sorted_supervisions)
+    # Page through the table (already sorted by the query) and select one
+    selected = browse_marked(supervisions)
+    if selected is None:
+        conn.close()
+        return
     
-    # Open in browser
-    url = f"https://kudos.chu.cam.ac.uk/kudos/rest/supervisions/upload-marked/{selected['uuid']}"
+    # Open the archived copy if there is one, otherwise in the browser
+    url = archived_copy(conn, selected['uuid'])
+    conn.close()
+    if url is None:
+        url = urljoin(KUDOS_URL, f"supervisions/upload-marked/{selected['uuid']}")
     open_url(url)
 
-def main():
-    print("KuDoS CLI 1.0")
-    config = load_config()
+def load_filtered_supervisions(offline=False):
+    """
+    Download the user's defaults and supervision assignments and filter them.
+
+    Returns:
+        SupervisionIndex: Supervisions in the user's tripos that still need work, or None on error
+    """
+    import requests
+
+    if not offline:
+        get_client()  # read config.json (or log in) before two threads need it
+
+    # The two requests don't depend on each other, so send them together.
+    # Supervisions are then streamed from KuDoS (or the local cache)
+    # straight into the filter once the tripos is known
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        defaults_future = pool.submit(cached_get_json, "users/defaults", offline=offline)
+        supervisions = cached_iter_json("supervisions/getSVAssignments", offline=offline)
+        defaults = defaults_future.result()
 
-    response = requests.get("https://kudos.chu.cam.ac.uk/kudos/rest/users/defaults", cookies={"KuDoSAuth": config['auth']})
-    if (response.status_code != 200):
+    if defaults is None or supervisions is None:
+        if supervisions is not None:
+            supervisions.close()
         print("KuDoS error!")
+        return None
+    target_tripos = defaults['tripos']
+    
+    # Parse into indexed records, keeping only the ones that pass the filters
+    try:
+        with span("filter_supervisions"):
+            return SupervisionIndex.filtered_from_payload(supervisions, target_tripos)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        # The download broke off part way; the previous copy is still in the cache
+        cache_file = _cache_file("supervisions/getSVAssignments")
+        if _read_cache_meta(cache_file) is None:
+            print(f"Error fetching supervisions/getSVAssignments: {e}")
+            print("KuDoS error!")
+            return None
+        print(f"Warning: download of supervisions/getSVAssignments failed ({e}), using the cached copy")
+        with span("filter_supervisions"):
+            return SupervisionIndex.filtered_from_payload(_iter_cached_records(cache_file), target_tripos)
+
+def refresh_marked_store():
+    """
+    sync_marked on a connection of its own, quietly, for running in the background.
+
+    It never starts a login.  A failed sync (including a rejected cookie)
+    raises, so the foreground sync in main2 tries again, logging in if need
+    be, and reports why.
+    """
+    conn = open_store()
+    try:
+        if not sync_marked(conn, quiet=True, renew=False):
+            raise RuntimeError("could not sync marked work")
+        return True
+    finally:
+        conn.close()
+
+def prefetch_next_steps(filtered_supervisions):
+    """
+    Start fetching, in the background, what the menu's next step will likely need.
+
+    That is the upload-marked listing (for "View marked work") and the
+    infofile of the first booked slot.  The infofile is only downloaded
+    and kept in memory: it is written to the slot's directory, by
+    fetch_remote_info or process_infofile, only once the user picks the slot.
+    """
+    prefetch("marked", refresh_marked_store)
+    for supervision in filtered_supervisions:
+        if supervision.booked_slots:
+            url = infofile_url(supervision.raw, 1)
+            prefetch(url, prefetch_get, url)
+            break
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="KuDoS supervision work CLI")
+    parser.add_argument("--offline", action="store_true",
+                        help="serve everything from the local response cache")
+    parser.add_argument("--base-url", metavar="URL",
+                        help="KuDoS REST API root (default: $KUDOS_BASE_URL, or the live server)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a Chrome trace of this run to FILE and print a timing summary")
+    parser.add_argument("--weeks", type=float,
+                        help="how many weeks of marked work to show (default: 4)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    build_parser = subparsers.add_parser(
+        "build-all", help="compile and upload every supervision directory")
+    build_parser.add_argument("-j", "--jobs", type=int,
+                              help="concurrent tectonic runs (default: CPU count)")
+    build_parser.add_argument("--no-upload", action="store_true",
+                              help="only compile, do not upload to KuDoS")
+    build_parser.add_argument("--preamble-cache", action="store_true",
+                              help="compile with pdflatex against a cached template preamble")
+    build_parser.add_argument("--optimize", action="store_true",
+                              help="shrink PDFs with Ghostscript/qpdf before uploading "
+                                   "(default: \"optimize\" config key)")
+
+    prefetch_parser = subparsers.add_parser(
+        "prefetch", help="scaffold every booked slot and download its infofile")
+    prefetch_parser.add_argument("-c", "--concurrency", type=int,
+                                 default=DEFAULT_PREFETCH_CONCURRENCY,
+                                 help="maximum concurrent downloads (default: %(default)s)")
+    prefetch_parser.add_argument("--unbooked", action="store_true",
+                                 help="also scaffold unbooked slots with a synthetic infofile")
+
+    watch_parser = subparsers.add_parser(
+        "watch", help="recompile a supervision directory whenever it is saved")
+    watch_parser.add_argument("directory")
+    watch_parser.add_argument("--upload", action="store_true",
+                              help="upload each successful build to KuDoS")
+    watch_parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                              help="seconds to wait for edits to settle (default: %(default)s)")
+    watch_parser.add_argument("--preamble-cache", action="store_true",
+                              help="compile with pdflatex against a cached template preamble")
+    watch_parser.add_argument("--optimize", action="store_true",
+                              help="shrink PDFs with Ghostscript/qpdf before uploading "
+                                   "(default: \"optimize\" config key)")
+
+    # Filters shared by the marked-work commands
+    marked_filters = argparse.ArgumentParser(add_help=False)
+    marked_filters.add_argument("--since", type=parse_date,
+                                help="only work after this ISO date (default: --weeks ago)")
+    marked_filters.add_argument("--until", type=parse_date,
+                                help="only work before this ISO date")
+    marked_filters.add_argument("--supervisor", help="only work for this supervisor CRSID")
+    marked_filters.add_argument("--group", type=int, help="only work for this group number")
+    # SUPPRESS, so `--weeks N marked` given before the subcommand isn't reset to None
+    marked_filters.add_argument("--weeks", type=float, default=argparse.SUPPRESS,
+                                help="how many weeks of marked work to include (default: 4)")
+
+    marked_parser = subparsers.add_parser(
+        "marked", parents=[marked_filters], help="sync and browse marked work")
+    marked_parser.add_argument("--failed", action="store_true", help="only failed uploads")
+
+    archive_parser = subparsers.add_parser(
+        "archive", parents=[marked_filters], help="download all marked PDFs in a date range")
+    archive_parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_ARCHIVE_JOBS,
+                                help="concurrent downloads (default: %(default)s)")
+
+    outbox_parser = subparsers.add_parser(
+        "outbox", help="show uploads waiting to be sent to KuDoS")
+    outbox_parser.add_argument("--drain", action="store_true",
+                               help="send queued uploads now, in the foreground")
+    outbox_parser.add_argument("--retry", action="store_true",
+                               help="queue failed uploads again and send them in the background")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global tracer
+    args = parse_args(argv)
+    print("KuDoS CLI 1.0")
+    if args.base_url:
+        set_base_url(args.base_url)
+
+    if args.trace is None:
+        return run(args)
+
+    tracer = Tracer()
+    try:
+        with span("main", command=args.command or "interactive"):
+            return run(args)
+    finally:
+        tracer.write(args.trace)
+        tracer.summary()
+        print(f"Trace written to {args.trace}")
+
+def run(args):
+    if args.command == "build-all":
+        directories = find_supervision_dirs()
+        if not directories:
+            print("No supervision directories found.")
+            return
+        build_all(directories, jobs=args.jobs, upload=not args.no_upload,
+                  preamble_cache=args.preamble_cache,
+                  optimize=args.optimize or load_config().get('optimize', False))
         return
-    target_tripos = json.loads(response.text)['tripos']
 
-    response = requests.get("https://kudos.chu.cam.ac.uk/kudos/rest/supervisions/getSVAssignments", cookies={"KuDoSAuth": config['auth']})
-    if (response.status_code != 200):
-        print("KuDoS error!")
+    if args.command == "watch":
+        watch(args.directory, debounce=args.debounce, upload=args.upload,
+              preamble_cache=args.preamble_cache,
+              optimize=args.optimize or load_config().get('optimize', False))
         return
 
+    if args.command == "outbox":
+        conn = open_store()
+        if args.retry:
+            if sys.stdin.isatty():
+                # Uploads may be waiting on a login the background drainer couldn't do
+                get_client().ensure_authenticated()
+            with conn:
+                conn.execute("UPDATE outbox SET failed = 0, attempts = 0, next_attempt = ? WHERE failed = 1",
+                             (time.time(),))
+            if not args.drain:
+                start_drain()
+        if args.drain:
+            uploaded = drain_outbox(conn, interactive=sys.stdin.isatty(), progress=sys.stdout.isatty())
+            print(f"{uploaded} upload(s) sent.")
+        else:
+            show_outbox(conn)
+        conn.close()
+        return
 
-    
-    # Load supervisions from file
-    supervisions = json.loads(response.text)
-    if not supervisions:
+    if args.command == "archive":
+        conn = open_store()
+        sync_marked(conn)
+        entries = query_marked(conn, since=marked_window(False, args.weeks, args.since), until=args.until,
+                               supervisor=args.supervisor, group=args.group)
+        archive_marked(conn, entries, jobs=args.jobs)
+        conn.close()
+        return
+
+    if args.command == "marked":
+        main2(args.offline, args.weeks, since=args.since, until=args.until,
+              supervisor=args.supervisor, group=args.group, failed=args.failed or None)
+        return
+
+    filtered_results = load_filtered_supervisions(args.offline)
+    if not filtered_results:
+        return
+
+    if args.command == "prefetch":
+        scaffold_slots(filtered_results, concurrency=args.concurrency, unbooked=args.unbooked)
         return
-    
-    # Apply filters
-    filtered_results = filter_supervisions(supervisions, target_tripos)
-    
 
+    if not args.offline:
+        prefetch_next_steps(filtered_results)
     if (select_supervision_slot(filtered_results)):
-        main2()
+        main2(args.offline, args.weeks)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,333 @@
+"""
+Local stand-in for the KuDoS REST API, for testing and load-testing the CLI.
+
+Serves users/defaults, supervisions/getSVAssignments,
+supervisions/infofile/<supervisor>/<group>/<n>, supervisions/upload and
+supervisions/upload-marked (plus upload-marked/<uuid> PDFs) under
+/kudos/rest/, with reproducible synthetic payloads from bench.py.  Every
+request must carry the KuDoSAuth cookie given by --token, and JSON payloads
+and infofiles honour If-None-Match like the real server.
+
+Usage:
+    python kudos_sim.py                                  # http://127.0.0.1:8765/kudos/rest/
+    python kudos_sim.py --assignments 1000 --latency 50 --error-rate 0.02
+    python kudos.py --base-url http://127.0.0.1:8765/kudos/rest/
+
+The CLI's config.json needs "auth" set to the simulator's token and
+"crsid" to --crsid (who is enrolled in every supervision), so run the CLI
+from a directory with a config.json of its own.  Cached responses, the
+marked store and the outbox are kept per base URL (see kudos.server_dir),
+so they never mix with the real server's.
+"""
+import argparse
+import hashlib
+import http.cookies
+import http.server
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import bench
+import kudos
+
+API_ROOT = "/kudos/rest/"
+DEFAULT_PORT = 8765
+DEFAULT_TOKEN = "sim-token"
+DEFAULT_CRSID = "sim123"
+DEFAULT_ASSIGNMENTS = 20
+DEFAULT_MARKED = 200
+DEFAULT_PDF_SIZE = 200_000
+THROTTLE_CHUNK = 16 * 1024
+INFOFILE_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), kudos.INFOFILE_TEMPLATE)
+
+class Simulator:
+    """
+    The simulated server's data and knobs.
+
+    Payloads are generated and encoded once at startup, so serving them
+    costs the same as on a real server with a warm cache.
+
+    Args:
+        assignments (int): Supervisions in getSVAssignments
+        marked (int): Entries in the upload-marked listing
+        pdf_size (int): Size of each upload-marked/<uuid> PDF in bytes
+        latency (float): Seconds added before every response
+        jitter (float): Up to this many extra seconds, at random
+        throttle (int): Bandwidth cap in bytes/s per request, both ways (0 for none)
+        error_rate (float): Fraction of requests answered with one of error_statuses
+        error_statuses (list): Statuses used for injected errors
+        token (str): KuDoSAuth cookie value to accept
+        crsid (str): The student enrolled in every supervision
+        seed (int): Seed for the payloads and injected errors
+    """
+
+    def __init__(self, assignments=DEFAULT_ASSIGNMENTS, marked=DEFAULT_MARKED, pdf_size=DEFAULT_PDF_SIZE,
+                 latency=0.0, jitter=0.0, throttle=0, error_rate=0.0, error_statuses=(503,),
+                 token=DEFAULT_TOKEN, crsid=DEFAULT_CRSID, seed=0):
+        self.pdf_size = pdf_size
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = throttle
+        self.error_rate = error_rate
+        self.error_statuses = list(error_statuses)
+        self.token = token
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors_injected": 0, "auth_failures": 0, "uploads": 0, "bytes_uploaded": 0}
+
+        now = datetime.now(timezone.utc)
+        self.student = {"CRSID": crsid, "title": "Mx", "firstName": "Sim", "lastName": "Student"}
+        supervisions = bench.make_assignments(assignments, seed=seed, now=now)
+        for supervision in supervisions:
+            supervision["supervisees"].append({"user": self.student})
+        self.bookings = {
+            (supervision["supervisor"]["CRSID"], str(supervision["groupNumber"])): supervision
+            for supervision in supervisions
+        }
+        self.defaults = self._json({"tripos": bench.TARGET_TRIPOS})
+        self.assignments = self._json(supervisions)
+        self.marked_entries = bench.make_marked(marked, seed=seed, now=now)
+        self.marked = self._json(self.marked_entries)
+
+    @staticmethod
+    def _json(data):
+        body = json.dumps(data).encode()
+        return body, '"%s"' % hashlib.sha1(body).hexdigest()
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def delay(self):
+        with self.lock:
+            extra = self.rng.uniform(0, self.jitter) if self.jitter else 0.0
+        if self.latency or extra:
+            time.sleep(self.latency + extra)
+
+    def injected_error(self):
+        """A status to fail this request with, or None"""
+        with self.lock:
+            if self.error_rate and self.rng.random() < self.error_rate:
+                return self.rng.choice(self.error_statuses)
+        return None
+
+    def infofile(self, supervisor, group, slot, url):
+        """The rendered infofile for a booked slot, or None if it isn't booked"""
+        supervision = self.bookings.get((supervisor, group))
+        if supervision is None or not slot.isdigit() or not 1 <= int(slot) <= len(supervision["bookings"]):
+            return None
+        booking = supervision["bookings"][int(slot) - 1]
+        start = kudos.parse_datetime(booking["startTime"])
+        tutor = supervision["supervisor"]
+        return kudos.render_template(INFOFILE_TEMPLATE, {
+            'TRIPOS': kudos.latex_escape(supervision["group"][0]["tripos"]),
+            'COURSE': kudos.latex_escape(supervision["group"][0]["course"]),
+            'SVNUM': slot,
+            'VENUE': kudos.latex_escape(booking["venue"]),
+            'SVDATE': f"{start:%d/%m/%Y}",
+            'SVTIME': f"{start:%H:%M}",
+            'SVUPLOADKEY': url,
+            'SVR_NAME': kudos.latex_escape(f"{tutor['title']} {tutor['firstName']} {tutor['lastName']}"),
+            'SVR_PAPER_SIDED': "oneside",
+            'SVR_PAPER_HANDED': "right",
+            'STU_NAME': kudos.latex_escape(f"{self.student['title']} {self.student['firstName']} "
+                                           f"{self.student['lastName']}"),
+            'STU_EMAIL': self.student["CRSID"],
+        }).encode()
+
+    def marked_pdf(self, uuid):
+        """A PDF-looking body of pdf_size bytes, the same every time for a uuid"""
+        head = f"%PDF-1.4\n% marked work {uuid}\n".encode()
+        return head + hashlib.sha256(uuid.encode()).digest() * ((self.pdf_size - len(head)) // 32 + 1)
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "KuDoSSim/1.0"
+
+    @property
+    def sim(self):
+        return self.server.sim
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send(self, status, body=b"", content_type="text/plain", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        if not self.sim.throttle:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), THROTTLE_CHUNK):
+            chunk = body[start:start + THROTTLE_CHUNK]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / self.sim.throttle)
+
+    def send_payload(self, payload, content_type="application/json"):
+        body, etag = payload
+        if self.headers.get("If-None-Match") == etag:
+            self.send(304, headers={"ETag": etag})
+        else:
+            self.send(200, body, content_type, {"ETag": etag})
+
+    def read_body(self):
+        remaining = int(self.headers.get("Content-Length") or 0)
+        received = 0
+        while remaining:
+            chunk = self.rfile.read(min(remaining, THROTTLE_CHUNK))
+            if not chunk:
+                break
+            received += len(chunk)
+            remaining -= len(chunk)
+            if self.sim.throttle:
+                time.sleep(len(chunk) / self.sim.throttle)
+        return received
+
+    def authenticated(self):
+        cookies = http.cookies.SimpleCookie(self.headers.get("Cookie", ""))
+        return "KuDoSAuth" in cookies and cookies["KuDoSAuth"].value == self.sim.token
+
+    def route(self):
+        """Common request handling; returns the API path, or None if the request was answered"""
+        self.sim.count("requests")
+        received = self.read_body() if self.command == "POST" else 0
+        self.sim.delay()
+        path = self.path.split("?", 1)[0]
+        if not path.startswith(API_ROOT):
+            self.send(404, b"Not found")
+            return None
+        if not self.authenticated():
+            self.sim.count("auth_failures")
+            self.send(401, b"Unauthorized")
+            return None
+        status = self.sim.injected_error()
+        if status is not None:
+            self.sim.count("errors_injected")
+            self.send(status, b"Injected error")
+            return None
+        if self.command == "POST":
+            self.received = received
+        return path[len(API_ROOT):]
+
+    def do_GET(self):
+        path = self.route()
+        if path is None:
+            return
+        parts = path.split("/")
+        if path == "users/defaults":
+            self.send_payload(self.sim.defaults)
+        elif path == "supervisions/getSVAssignments":
+            self.send_payload(self.sim.assignments)
+        elif path == "supervisions/upload-marked":
+            self.send_payload(self.sim.marked)
+        elif len(parts) == 3 and parts[:2] == ["supervisions", "upload-marked"]:
+            self.send(200, self.sim.marked_pdf(parts[2]), "application/pdf")
+        elif len(parts) == 5 and parts[:2] == ["supervisions", "infofile"]:
+            url = f"http://{self.headers.get('Host')}{self.path}"
+            body = self.sim.infofile(parts[2], parts[3], parts[4], url)
+            if body is None:
+                self.send(404, b"No such booking")
+            else:
+                self.send_payload((body, '"%s"' % hashlib.sha1(body).hexdigest()), "text/plain")
+        else:
+            self.send(404, b"Not found")
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        path = self.route()
+        if path is None:
+            return
+        if path == "supervisions/upload":
+            self.sim.count("uploads")
+            self.sim.count("bytes_uploaded", self.received)
+            self.send(200, b"OK")
+        else:
+            self.send(404, b"Not found")
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, verbose=False, **options):
+    """
+    Create a simulator server; options are passed to Simulator.
+
+    Returns:
+        ThreadingHTTPServer: Not yet serving; port 0 picks a free port
+    """
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.sim = Simulator(**options)
+    server.verbose = verbose
+    return server
+
+def base_url(server):
+    """API root of a running simulator, for kudos.py --base-url"""
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{API_ROOT}"
+
+def serve_in_background(**options):
+    """
+    Start a simulator on a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: Call shutdown() to stop it
+    """
+    server = make_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local KuDoS API simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--assignments", type=int, default=DEFAULT_ASSIGNMENTS,
+                        help="supervisions in getSVAssignments (default: %(default)s)")
+    parser.add_argument("--marked", type=int, default=DEFAULT_MARKED,
+                        help="entries in the upload-marked listing (default: %(default)s)")
+    parser.add_argument("--pdf-size", type=int, default=DEFAULT_PDF_SIZE,
+                        help="bytes in each marked PDF (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="milliseconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="up to this many extra milliseconds, at random")
+    parser.add_argument("--throttle", type=int, default=0,
+                        help="bandwidth cap per request in bytes/s (default: none)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests that fail with an injected error")
+    parser.add_argument("--error-status", type=int, action="append",
+                        help="status for injected errors, may be repeated (default: 503)")
+    parser.add_argument("--token", default=DEFAULT_TOKEN,
+                        help="KuDoSAuth cookie to accept (default: %(default)s)")
+    parser.add_argument("--crsid", default=DEFAULT_CRSID,
+                        help="student enrolled in every supervision (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    server = make_server(
+        args.host, args.port, verbose=args.verbose,
+        assignments=args.assignments, marked=args.marked, pdf_size=args.pdf_size,
+        latency=args.latency / 1000, jitter=args.jitter / 1000, throttle=args.throttle,
+        error_rate=args.error_rate, error_statuses=args.error_status or (503,),
+        token=args.token, crsid=args.crsid, seed=args.seed,
+    )
+    print(f"KuDoS simulator at {base_url(server)} (token {args.token!r}, student {args.crsid!r})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("\n" + ", ".join(f"{key}: {value}" for key, value in server.sim.stats.items()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
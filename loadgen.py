@@ -0,0 +1,195 @@
+"""
+Load generator for end-to-end KuDoS CLI runs.
+
+Each run does what an interactive compile-and-upload session does, through
+kudos.py's own functions: load users/defaults and getSVAssignments, fetch a
+booked slot's infofile (and revalidate it), compile, queue the PDF in the
+outbox and drain it, and sync upload-marked into the local store.  A run
+only counts as successful if the upload went through and the sync did.  Runs are spread over worker processes, each with its
+own scratch directory, against kudos_sim.py (started in-process unless
+--base-url is given).  Reports runs/s, requests/s and p50/p99 latencies,
+end to end and per endpoint.
+
+Usage:
+    python loadgen.py                               # 4 workers x 10 runs each
+    python loadgen.py --workers 8 --runs 25 --latency 20 --error-rate 0.02
+    python loadgen.py --compile                     # real tectonic builds
+    python loadgen.py --base-url http://127.0.0.1:8765/kudos/rest/ --token sim-token
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import kudos
+import kudos_sim
+
+DEFAULT_WORKERS = 4
+DEFAULT_RUNS = 10
+DEFAULT_UPLOAD_SIZE = 500_000
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "template")
+
+_options = None
+
+def init_worker(base_url, scratch, options):
+    """Give a worker process its own scratch directory, config.json and tracer"""
+    global _options
+    _options = options
+    os.chdir(tempfile.mkdtemp(dir=scratch))
+    shutil.copytree(TEMPLATE_DIR, "template")
+    with open("config.json", "w") as f:
+        # TTLs of 0 make every run revalidate with the server, as after a day away
+        json.dump({"crsid": options["crsid"], "auth": options["token"], "cache_ttl": 0,
+                   "infofile_ttl": 0}, f)
+    kudos.set_base_url(base_url)
+    kudos.tracer = kudos.Tracer()
+
+def session(run):
+    """
+    One end-to-end compile-and-upload run.
+
+    Returns:
+        tuple: (succeeded, seconds, [(request span name, seconds), ...])
+    """
+    begin = time.perf_counter()
+    ok = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        if _options["cold"]:
+            shutil.rmtree(kudos.CACHE_DIR, ignore_errors=True)
+        supervisions = kudos.load_filtered_supervisions()
+        booked = [s for s in supervisions or () if s.booked_slots]
+        if booked:
+            supervision = booked[run % len(booked)]
+            dir_name = kudos.slot_dir_name(supervision.raw, 0)
+            if not kudos.slot_scaffolded(dir_name):
+                kudos.create_slot_dir(dir_name)
+            conn = kudos.open_store()
+            try:
+                # Drained in the foreground, so the upload (and its retries) are timed
+                ok = (kudos.fetch_remote_info(supervision.raw, 0, dir_name)
+                      and kudos.process_infofile(dir_name)
+                      and build(dir_name)
+                      and kudos.queue_upload(conn, dir_name) == "queued"
+                      and kudos.drain_outbox(conn) == 1
+                      and kudos.sync_marked(conn))
+            except Exception as e:
+                # A crashed run counts as failed rather than ending the whole batch
+                print(f"Run {run} failed: {e!r}", file=sys.stderr)
+            finally:
+                conn.close()
+    seconds = time.perf_counter() - begin
+
+    requests = [
+        (event["name"], event["dur"] / 1e6) for event in kudos.tracer.events
+        if event["name"].startswith(("GET ", "POST "))
+    ]
+    kudos.tracer.events.clear()
+    return bool(ok), seconds, requests
+
+def build(dir_name):
+    """Compile work.tex, or stand in a PDF of --upload-size bytes when not compiling"""
+    if _options["compile"]:
+        return kudos.compile_latex(dir_name, quiet=True, force=True)
+    with open(os.path.join(dir_name, "work.pdf"), "wb") as f:
+        f.write(b"%PDF-1.4\n" + os.urandom(_options["upload_size"]))
+    return True
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+def report(results, wall):
+    """Print throughput and latency percentiles for a batch of runs"""
+    runs = [seconds for _, seconds, _ in results]
+    by_name = {}
+    for _, _, requests in results:
+        for name, seconds in requests:
+            by_name.setdefault(name, []).append(seconds)
+    # Streamed bodies have spans of their own, alongside their request's
+    total_requests = sum(len(values) for name, values in by_name.items() if not name.endswith(" body"))
+    failed = sum(1 for ok, _, _ in results if not ok)
+
+    print(f"\n{len(results)} runs ({failed} failed) in {wall:.2f}s: "
+          f"{len(results) / wall:.1f} runs/s, {total_requests / wall:.1f} requests/s")
+    print("-" * 72)
+    print(f"{'':<40} {'Count':>7} {'p50 ms':>11} {'p99 ms':>11}")
+    print("-" * 72)
+    rows = [("end-to-end run", runs)] + sorted(by_name.items())
+    for name, values in rows:
+        print(f"{name:<40} {len(values):>7} {percentile(values, 50) * 1000:>11.1f} "
+              f"{percentile(values, 99) * 1000:>11.1f}")
+    print("-" * 72)
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="KuDoS CLI load generator")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="concurrent CLI sessions (default: %(default)s)")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS,
+                        help="runs per worker (default: %(default)s)")
+    parser.add_argument("--compile", action="store_true",
+                        help="compile with tectonic instead of uploading a stand-in PDF")
+    parser.add_argument("--upload-size", type=int, default=DEFAULT_UPLOAD_SIZE,
+                        help="bytes in the stand-in PDF (default: %(default)s)")
+    parser.add_argument("--cold", action="store_true",
+                        help="clear the response cache before every run")
+    parser.add_argument("--base-url", help="use this server instead of an in-process simulator")
+    parser.add_argument("--token", default=kudos_sim.DEFAULT_TOKEN, help="KuDoSAuth cookie to send")
+    parser.add_argument("--crsid", default=kudos_sim.DEFAULT_CRSID, help="CRSID to run as")
+    simulator = parser.add_argument_group("in-process simulator")
+    simulator.add_argument("--assignments", type=int, default=kudos_sim.DEFAULT_ASSIGNMENTS)
+    simulator.add_argument("--marked", type=int, default=kudos_sim.DEFAULT_MARKED)
+    simulator.add_argument("--latency", type=float, default=0.0, help="milliseconds per response")
+    simulator.add_argument("--jitter", type=float, default=0.0, help="extra milliseconds, at random")
+    simulator.add_argument("--throttle", type=int, default=0, help="bytes/s per request")
+    simulator.add_argument("--error-rate", type=float, default=0.0,
+                           help="fraction of requests answered with 503")
+    args = parser.parse_args(argv)
+
+    if args.compile and not shutil.which("tectonic"):
+        print("Error: --compile needs tectonic on the PATH")
+        return 1
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = kudos_sim.serve_in_background(
+            port=0, assignments=args.assignments, marked=args.marked,
+            latency=args.latency / 1000, jitter=args.jitter / 1000, throttle=args.throttle,
+            error_rate=args.error_rate, token=args.token, crsid=args.crsid,
+        )
+        base_url = kudos_sim.base_url(server)
+    print(f"Running {args.workers} x {args.runs} sessions against {base_url}")
+
+    options = {
+        "token": args.token, "crsid": args.crsid,
+        "compile": args.compile, "upload_size": args.upload_size, "cold": args.cold,
+    }
+    # spawn, so workers start clean on every platform (and don't inherit the server)
+    context = multiprocessing.get_context("spawn")
+    try:
+        with tempfile.TemporaryDirectory(prefix="kudos-loadgen-") as scratch, \
+             ProcessPoolExecutor(args.workers, mp_context=context, initializer=init_worker,
+                                 initargs=(base_url, scratch, options)) as pool:
+            # Warm the workers up first, so interpreter start-up isn't timed
+            list(pool.map(time.sleep, [0.1] * args.workers))
+            begin = time.perf_counter()
+            results = list(pool.map(session, range(args.workers * args.runs)))
+            wall = time.perf_counter() - begin
+    finally:
+        if server is not None:
+            server.shutdown()
+            print(", ".join(f"{key}: {value}" for key, value in server.sim.stats.items()))
+
+    return 1 if report(results, wall) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Startup-time check for the KuDoS CLI.
+
+Imports kudos in a fresh interpreter under `python -X importtime` and
+reports the import cost of each top-level module it pulls in.  Exits
+non-zero if a module that must stay lazy (selenium, requests) is imported
+at startup or the total import time exceeds the budget.
+
+Usage: python startup_check.py [--budget-ms 150] [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules kudos.py must only import inside the functions that use them
+LAZY_MODULES = ("selenium", "requests", "urllib3")
+DEFAULT_BUDGET_MS = 150
+
+def measure_imports(module="kudos"):
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        list: (name, self_us, cumulative_us, depth) for every import, in import order
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nesting is shown by two spaces of indentation per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+def direct_imports(imports, module="kudos"):
+    """
+    Split the import cost of a module into what each of its own imports costs.
+
+    Returns:
+        tuple: (total_us, [(name, cumulative_us), ...])
+    """
+    for idx, (name, _, cumulative, depth) in enumerate(imports):
+        if name == module and depth == 0:
+            break
+    else:
+        raise ValueError(f"{module} not found in import trace")
+
+    # Children are printed before their parent, one level deeper
+    children = []
+    for child, _, child_cumulative, child_depth in reversed(imports[:idx]):
+        if child_depth == 0:
+            break
+        if child_depth == 1:
+            children.append((child, child_cumulative))
+    return cumulative, children
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="fail if importing kudos takes longer (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=15,
+                        help="number of most expensive modules to list")
+    args = parser.parse_args(argv)
+
+    imports = measure_imports()
+    total_us, children = direct_imports(imports)
+    total_ms = total_us / 1000
+
+    print(f"{'Module':<40} {'Cumulative (ms)':>15}")
+    print("-" * 56)
+    for name, cumulative in sorted(children, key=lambda m: m[1], reverse=True)[:args.top]:
+        print(f"{name:<40} {cumulative / 1000:>15.2f}")
+    print("-" * 56)
+    print(f"{'kudos (total)':<40} {total_ms:>15.2f}")
+
+    failed = False
+    eager = sorted({name for name, _, _, _ in imports if name.split(".")[0] in LAZY_MODULES})
+    if eager:
+        print(f"\nFAIL: imported at startup but should be lazy: {', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"\nFAIL: importing kudos took {total_ms:.1f} ms, budget is {args.budget_ms:g} ms")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
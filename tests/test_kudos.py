@@ -0,0 +1,228 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+import kudos
+import kudos_sim
+
+
+def chunked(text, size):
+    data = text.encode("utf-8")
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("text", [
+    "[]",
+    " [ ] ",
+    "[1]",
+    "[1, 2.5, -3e10, 4E-2, 0]",
+    '[true, false, null, "x"]',
+    '[{"a": [1, 2]}, [3, {"b": "c]"}], "d,e"]',
+    '[ "café" , {"ü": 1.25e+3} ]\n',
+])
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1024])
+def test_iter_json_array_matches_json_loads(text, size):
+    assert list(kudos.iter_json_array(chunked(text, size))) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunks, expected", [
+    ([b"[1,", b"2.", b"5]"], [1, 2.5]),
+    ([b"[-3e", b"10]"], [-3e10]),
+    ([b"[12", b"34]"], [1234]),
+    ([b"[tr", b"ue, nu", b"ll]"], [True, None]),
+    ([b"[1", b"]"], [1]),
+])
+def test_iter_json_array_scalar_split_across_chunks(chunks, expected):
+    assert list(kudos.iter_json_array(chunks)) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "[1 2]",
+    "[1,,2]",
+    "[,1]",
+    "[1,]",
+    "[1.2.3]",
+    "[truex]",
+    "[1",
+    "[1,",
+    '[{"a": 1}',
+    "{}",
+    "",
+])
+@pytest.mark.parametrize("size", [1, 1024])
+def test_iter_json_array_rejects_invalid(text, size):
+    with pytest.raises(ValueError):
+        list(kudos.iter_json_array(chunked(text, size)))
+
+
+def test_iter_json_array_yields_before_the_end():
+    def chunks():
+        yield b'[{"a": 1}, '
+        raise AssertionError("read past the first element")
+
+    assert next(kudos.iter_json_array(chunks())) == {"a": 1}
+
+
+def write(path, content=""):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def test_latex_dependencies_follows_inputs(tmp_path):
+    write(tmp_path / "work.tex", "\\input{../template/template}\n\\include{part.tex}\n% \\input{commented}\n")
+    write(tmp_path.parent / "template" / "template.tex", "\\input{../template/includes}")
+    write(tmp_path.parent / "template" / "includes.tex")
+    write(tmp_path / "part.tex")
+    write(tmp_path / "commented.tex")
+
+    assert kudos.latex_dependencies(tmp_path) == [
+        "../template/includes.tex", "../template/template.tex", "part.tex", "work.tex",
+    ]
+
+
+def test_latex_dependencies_resolves_graphics_extensions(tmp_path):
+    write(tmp_path / "work.tex",
+          "\\includegraphics[width=5cm]{figs/plot}\n\\includegraphics{photo.jpg}\n\\includegraphics{missing}\n")
+    write(tmp_path / "figs" / "plot.png")
+    write(tmp_path / "figs" / "plot.txt")
+    write(tmp_path / "photo.jpg")
+
+    assert kudos.latex_dependencies(tmp_path) == ["figs/plot.png", "photo.jpg", "work.tex"]
+
+
+def test_latex_dependencies_finds_epsfig_listings_and_verbatim(tmp_path):
+    write(tmp_path / "work.tex",
+          "\\epsfig{file=circuit,width=0.5\\linewidth}\n"
+          "\\psfig{figure=old.eps, file = diagram.eps}\n"
+          "\\lstinputlisting[language=Python]{code/solution.py}\n"
+          "\\verbatiminput{output.txt}\n")
+    write(tmp_path / "circuit.eps")
+    write(tmp_path / "diagram.eps")
+    # Listings aren't TeX, so an \input in one isn't followed
+    write(tmp_path / "code" / "solution.py", "print('\\\\input{nothere}')")
+    write(tmp_path / "nothere.tex")
+    write(tmp_path / "output.txt")
+
+    assert kudos.latex_dependencies(tmp_path) == [
+        "circuit.eps", "code/solution.py", "diagram.eps", "output.txt", "work.tex",
+    ]
+
+
+def test_hash_inputs_sees_extensionless_image_edits(tmp_path):
+    write(tmp_path / "work.tex", "\\includegraphics{plot}")
+    write(tmp_path / "plot.pdf", "one")
+    before = kudos.hash_inputs(tmp_path)
+    write(tmp_path / "plot.pdf", "two")
+
+    assert kudos.hash_inputs(tmp_path) != before
+
+
+@pytest.mark.parametrize("url", ["http://host/kudos/rest", "http://host/kudos/rest/"])
+def test_base_url_keeps_its_last_segment(url):
+    client = kudos.KuDoSClient("token", base_url=kudos.normalise_base_url(url))
+    assert client.url("users/defaults") == "http://host/kudos/rest/users/defaults"
+
+
+@pytest.fixture(scope="module")
+def sim():
+    server = kudos_sim.serve_in_background(port=0, assignments=10, marked=10)
+    yield server
+    server.shutdown()
+
+
+class StubLogin:
+    """reauthenticate stand-in that hands out the simulator's token and counts logins"""
+
+    def __init__(self, delay=0.0):
+        self.calls = 0
+        self.delay = delay
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return kudos_sim.DEFAULT_TOKEN, None
+
+
+def make_client(sim, token, login=None, **kwargs):
+    return kudos.KuDoSClient(token, base_url=kudos_sim.base_url(sim), reauthenticate=login, **kwargs)
+
+
+def requests_made(sim, fn):
+    before = sim.sim.stats["requests"]
+    result = fn()
+    return result, sim.sim.stats["requests"] - before
+
+
+def test_validate_is_cached_per_cookie(sim):
+    client = make_client(sim, kudos_sim.DEFAULT_TOKEN)
+
+    assert requests_made(sim, client.validate) == (True, 1)
+    assert requests_made(sim, client.validate) == (True, 0)
+    client.set_auth("wrong")
+    assert requests_made(sim, client.validate) == (False, 1)
+
+
+def test_rejected_cookie_is_renewed_and_the_request_retried(sim):
+    login = StubLogin()
+    client = make_client(sim, "wrong", login)
+
+    response = client.get("users/defaults")
+
+    assert response.status_code == 200
+    assert login.calls == 1
+    assert client.auth == kudos_sim.DEFAULT_TOKEN
+
+
+def test_expired_cookie_is_renewed_before_sending(sim):
+    login = StubLogin()
+    client = make_client(sim, "wrong", login, expires=time.time() - 1)
+
+    response, sent = requests_made(sim, lambda: client.get("users/defaults"))
+
+    assert response.status_code == 200
+    assert (login.calls, sent) == (1, 1)
+
+
+def test_concurrent_rejections_renew_once(sim):
+    login = StubLogin(delay=0.2)
+    client = make_client(sim, "wrong", login)
+    start = threading.Barrier(8)
+    statuses = []
+
+    def fetch():
+        start.wait()
+        statuses.append(client.get("users/defaults").status_code)
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * 8
+    assert login.calls == 1
+
+
+def test_streamed_body_is_not_replayed(sim):
+    login = StubLogin()
+    client = make_client(sim, "wrong", login)
+
+    response = client.post("supervisions/upload", data=io.BytesIO(b"%PDF-1.4 body"))
+
+    assert kudos.KuDoSClient.is_auth_failure(response)
+    assert login.calls == 0
+
+
+def test_renew_false_never_logs_in(sim):
+    login = StubLogin()
+    client = make_client(sim, "wrong", login, expires=time.time() - 1)
+
+    response = client.get("users/defaults", renew=False)
+
+    assert kudos.KuDoSClient.is_auth_failure(response)
+    assert login.calls == 0
+    client.ensure_authenticated()
+    assert login.calls == 1